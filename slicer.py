@@ -0,0 +1,2187 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu2@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: Slice STL CAD file layer by layer, without the GUI
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import numpy
+import os
+import sys
+import time
+import logging
+import struct
+import math
+import Queue
+import multiprocessing
+import tempfile
+import shutil
+import gzip
+import itertools
+import operator
+import mmap
+import re
+import hashlib
+import optparse
+
+__all__ = ['ERROR', 'REDO', 'LAYER', 'NOT_LAYER', 'INTERSECTED',
+           'NOT_INTERSECTED', 'SCANLINE', 'NOT_SCANLINE', 'LIMIT',
+           'DIRECTIONS', 'equal', 'STL_HEADER_SIZE', 'STL_RECORD',
+           'is_binary_stl', 'STL_BLOCK_SIZE', 'STATS_BLOCK_SIZE',
+           'STL_FACET_TOKENS', 'STL_NUMBER_COLUMNS', 'STL_FACET_LINES',
+           'STREAM_BAND_LAYERS', 'SLICE_CACHE_DIR', 'SLICE_CACHE_SIZE',
+           'SLICE_CACHE_KEYS', 'PREVIEW_CELLS',
+           'SLICE_WRITE_BUFFER', 'SLICE_GZIP_LEVEL', 'SLICE_EXT',
+           'SLICE_MAGIC', 'SLICE_VERSION', 'SLICE_HEADER',
+           'SLICE_COORDINATES', 'SLICE_LAYER', 'XML_POINT',
+           'EndFileException', 'FormatError', 'Point', 'Line', 'intersect',
+           'is_intersected', 'calc_intersected_point', 'Facet',
+           'intersect_facets', 'calc_intersected_points', 'FacetList',
+           'SweepIndex', 'Layer', 'LINE_POINTS', 'path_points',
+           'LINE_FORMAT', 'format_paths', 'Transform', 'MeshStats',
+           'FacetBuckets', 'slice_writer', 'XmlSliceWriter',
+           'BinarySliceWriter', 'SliceFile', 'XmlSliceFile', 'xml_points',
+           'read_slice_file', 'build_layer', 'path_lines', 'SliceLayers',
+           'SliceCache', 'mesh_hash', 'CadModel', 'model_arrays',
+           'cluster_facets']
+
+ERROR = 2
+REDO = 3
+LAYER = 4
+NOT_LAYER = 5
+INTERSECTED = 6
+NOT_INTERSECTED = 7
+SCANLINE = 8
+NOT_SCANLINE = 9
+LIMIT = 1e-8
+
+# Slicing direction: source axis and sign of the new x, y and z
+DIRECTIONS = {"+X": ((2, 1, 0), (1, 1, 1)),
+              "-X": ((2, 1, 0), (1, 1, -1)),
+              "+Y": ((0, 2, 1), (1, 1, 1)),
+              "-Y": ((0, 2, 1), (1, 1, -1)),
+              "+Z": ((0, 1, 2), (1, 1, 1)),
+              "-Z": ((0, 1, 2), (1, 1, -1))}
+
+def equal(f1, f2):
+    if abs(f1 - f2) < LIMIT:
+        return True
+    else:
+        return False
+
+STL_HEADER_SIZE = 84
+STL_RECORD = numpy.dtype([('normal', '<f4', (3,)),
+                          ('vertices', '<f4', (3, 3)),
+                          ('attribute', '<u2')])
+
+def is_binary_stl(f):
+    ''' A binary STL file is exactly header + 50 bytes per facet long'''
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(0)
+    if size < STL_HEADER_SIZE:
+        return False
+    
+    header = f.read(STL_HEADER_SIZE)
+    f.seek(0)
+    n = struct.unpack('<I', header[80:])[0]
+    return size == STL_HEADER_SIZE + n * STL_RECORD.itemsize
+
+STL_BLOCK_SIZE = 1 << 22
+# Facets per block of the model statistics sweep and of streamed STL files
+STATS_BLOCK_SIZE = 1 << 16
+STL_FACET_TOKENS = ('facet', 'normal', None, None, None,
+                    'outer', 'loop',
+                    'vertex', None, None, None,
+                    'vertex', None, None, None,
+                    'vertex', None, None, None,
+                    'endloop',
+                    'endfacet')
+STL_NUMBER_COLUMNS = [i for i, word in enumerate(STL_FACET_TOKENS) if word is None]
+STL_FACET_LINES = (0, 5, 7, 11, 15, 19, 20)
+# Layers per band of the out-of-core slicer
+STREAM_BAND_LAYERS = 64
+# Slice cache directory and its size limit in bytes
+SLICE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.blackcat', 'cache')
+SLICE_CACHE_SIZE = 512 << 20
+# Slice parameters that change the layers
+SLICE_CACHE_KEYS = ("height", "pitch", "direction", "scale", "processes", 
+                    "xangle", "yangle", "zangle")
+# Grid cells along the longest side of the model for the preview
+PREVIEW_CELLS = 100
+SLICE_WRITE_BUFFER = 1 << 20
+SLICE_GZIP_LEVEL = 6
+
+# Binary slice file: magic, version, bytes per coordinate, number of 
+# layers, x, y, z size, layer height, pitch, speed and the offset of the 
+# layer index
+SLICE_EXT = '.bcs'
+SLICE_MAGIC = 'BCSLICE\0'
+SLICE_VERSION = 2
+SLICE_HEADER = struct.Struct('<8sIII6dQ')
+SLICE_COORDINATES = {4: '<f4', 8: '<f8'}
+# Layer record: z, number of loops and chunks
+SLICE_LAYER = struct.Struct('<dII')
+XML_POINT = re.compile(r'<x> (\S+) </x> <y> (\S+) </y> <z> (\S+) </z>')
+
+class EndFileException(Exception):
+    def __init__(self, args=None):
+        self.args = args
+
+class FormatError(Exception):
+    def __init__(self, value=None):
+        self.value = value
+    
+    def __str__(self):
+        return 'FormatError:' + self.value
+
+class Point:
+    ''' A point in model space.
+
+    key snaps the point onto an integer grid of LIMIT spacing and is 
+    computed once, so the coordinates must not change afterwards. Points 
+    with the same key are equal; points within LIMIT of each other but 
+    across a grid line are equal too, though they hash apart. Points are
+    ordered by key, x first, then y, then z, which is a total ordering.
+    '''
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.key = (int(round(x / LIMIT)), int(round(y / LIMIT)), int(round(z / LIMIT)))
+
+    def __str__(self):
+        s = '(%f, %f, %f) ' % (self.x, self.y, self.z)
+        return s
+
+    def __eq__(self, other):
+        if self.key == other.key:
+            return True
+        return (abs(self.x - other.x) < LIMIT and abs(self.y - other.y) < LIMIT 
+                and abs(self.z - other.z) < LIMIT)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __cmp__(self, other):
+        return cmp(self.key, other.key)
+    
+    def __hash__(self):
+        return hash(self.key)
+
+class Line:
+    def __init__(self, p1=Point(), p2=Point()):
+        self.p1 = p1
+        self.p2 = p2
+
+    def __str__(self):
+        return str(self.p1) + " -> " + str(self.p2)
+
+    def length(self):
+        dx = self.p1.x - self.p2.x
+        dy = self.p1.y - self.p2.y
+        dz = self.p1.z - self.p2.z
+        sum = dx * dx + dy * dy + dz * dz
+        return math.sqrt(sum)
+    
+    def slope(self):
+        diffy = self.p2.y - self.p1.y 
+        diffx = self.p2.x - self.p1.x
+        
+        if equal(diffx, 0.0):
+            return sys.maxint
+        else:
+            k = diffy / diffx
+            return k
+
+def intersect(x1, y1, x2, y2, x):
+    ''' compute y'''
+    y = (y2 - y1) / (x2 - x1) * (x - x1) + y1
+    return y
+
+def is_intersected(p1, p2, z):
+    if (p1.z - z) * (p2.z - z) <= 0.0:
+        return True
+    else:
+        return False
+
+def calc_intersected_point(p1, p2, z):
+    x1 = p1.x
+    y1 = p1.y
+    z1 = p1.z
+
+    x2 = p2.x
+    y2 = p2.y
+    z2 = p2.z
+    
+    x = intersect(z1, x1, z2, x2, z)
+    y = intersect(z1, y1, z2, y2, z)
+    p = Point(x, y, z)
+    return p
+
+class Facet:
+    def __init__(self, normal=None, points=None):
+        if normal is None:
+            normal = Point()
+        if points is None:
+            points = (Point(), Point(), Point())
+        self.normal = normal
+        self.points = points
+
+    def __str__(self):
+        s = 'normal: ' + str(self.normal)
+        s += ' points:'
+        for p in self.points:
+            s += str(p)
+        return s
+    
+    def change_direction(self, direction):
+        if direction == "+X":
+            points = [Point(p.z, p.y, p.x) for p in self.points]
+        elif direction == "-X":
+            points = [Point(p.z, p.y, -p.x) for p in self.points]
+        elif direction == "+Y":
+            points = [Point(p.x, p.z, p.y) for p in self.points]
+        elif direction == "-Y":
+            points = [Point(p.x, p.z, -p.y) for p in self.points]
+        elif direction == '-Z':
+            points = [Point(p.x, p.y, -p.z) for p in self.points]
+        elif direction == '+Z':
+            points = self.points
+        else:
+            assert 0
+        self.points = points
+
+    def intersect(self, z):
+        L1 = [True for p in self.points if p.z > z]
+        L2 = [True for p in self.points if p.z < z]
+        if len(L1) == 3 or len(L2) == 3:
+            return (NOT_INTERSECTED, None)
+        
+        L1 = []
+        L2 = []
+        for i in range(3):
+            p = self.points[i]
+            if equal(p.z, z):
+                L1.append(i)
+            else:
+                L2.append(i)
+        
+        points = self.points
+        n = len(L1)
+        if n == 0:
+            line = self.intersect_0_vertex(points, z)
+            code = INTERSECTED
+        elif n == 1:
+            i1 = L2[0]
+            i2 = L2[1]
+            p1 = points[i1]
+            p2 = points[i2]
+            if is_intersected(p1, p2, z):
+                line = self.intersect_1_vertex(points[L1[0]], p1, p2, z)
+                code = INTERSECTED
+            else:
+                line = None
+                code = NOT_INTERSECTED
+        elif n == 2 or n == 3:
+            code = REDO
+            line = None
+        
+        return (code, line)
+
+    def intersect_0_vertex(self, points, z):
+        L = []
+        for i in range(3):
+            next = (i + 1) % 3
+            p1 = points[i]
+            p2 = points[next]
+            if is_intersected(p1, p2, z):
+                p = calc_intersected_point(p1, p2, z)
+                L.append(p)
+        
+        assert len(L) == 2
+        return Line(L[0], L[1])
+
+    def intersect_1_vertex(self, p1, p2, p3, z):
+        p = calc_intersected_point(p2, p3, z)
+        return Line(p1, p)
+
+def intersect_facets(vertices, z):
+    ''' Intersect (n, 3, 3) facets with the plane z in one vectorized pass.
+
+    z is either one plane for all facets or an array with a plane per
+    facet. Returns a code per facet, INTERSECTED, NOT_INTERSECTED or REDO 
+    as in Facet.intersect, and an (n, 2, 2) array holding the x, y of both
+    segment ends of the intersected facets.
+    '''
+    z = numpy.asarray(z, dtype=numpy.float64)
+    if z.ndim == 1:
+        z = z[:, numpy.newaxis]
+    
+    n = len(vertices)
+    codes = numpy.empty(n, dtype=numpy.int8)
+    codes.fill(NOT_INTERSECTED)
+    segments = numpy.zeros((n, 2, 2))
+    
+    d = vertices[:, :, 2] - z
+    spanned = ~((d > 0.0).all(axis=1) | (d < 0.0).all(axis=1))
+    no_on = (numpy.abs(d) < LIMIT).sum(axis=1)
+    codes[spanned & (no_on >= 2)] = REDO
+    
+    err = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        # No vertex on the plane: the first two edges crossing it
+        rows = numpy.flatnonzero(spanned & (no_on == 0))
+        if len(rows):
+            v = vertices[rows]
+            dz = d[rows]
+            zz = z[rows] if z.ndim else z
+            e0 = calc_intersected_points(v[:, 0], v[:, 1], zz)
+            e1 = calc_intersected_points(v[:, 1], v[:, 2], zz)
+            e2 = calc_intersected_points(v[:, 2], v[:, 0], zz)
+            cross0 = (dz[:, 0] * dz[:, 1] <= 0.0)[:, numpy.newaxis]
+            cross1 = (dz[:, 1] * dz[:, 2] <= 0.0)[:, numpy.newaxis]
+            segments[rows, 0] = numpy.where(cross0, e0, e1)
+            segments[rows, 1] = numpy.where(cross0 & cross1, e1, e2)
+            codes[rows] = INTERSECTED
+        
+        # One vertex on the plane: intersected if the other two straddle it
+        rows = numpy.flatnonzero(spanned & (no_on == 1))
+        if len(rows):
+            k = numpy.abs(d[rows]).argmin(axis=1)
+            i = numpy.array([1, 0, 0])[k]
+            j = numpy.array([2, 2, 1])[k]
+            pi = vertices[rows, i]
+            pj = vertices[rows, j]
+            ok = (d[rows, i] * d[rows, j] <= 0.0)
+            zz = z[rows] if z.ndim else z
+            segments[rows, 0] = vertices[rows, k, :2]
+            segments[rows, 1] = calc_intersected_points(pi, pj, zz)
+            codes[rows[ok]] = INTERSECTED
+    finally:
+        numpy.seterr(**err)
+    
+    return codes, segments
+
+def calc_intersected_points(p1, p2, z):
+    ''' Vectorized calc_intersected_point on (n, 3) arrays, returns x, y'''
+    z1 = p1[:, 2:]
+    z2 = p2[:, 2:]
+    return (p2[:, :2] - p1[:, :2]) / (z2 - z1) * (z - z1) + p1[:, :2]
+
+class FacetList:
+    ''' Read-only sequence of Facet views over the facet arrays of a model'''
+    def __init__(self, normals, vertices):
+        self.normals = normals
+        self.vertices = vertices
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def __getitem__(self, i):
+        normal = Point(*self.normals[i].tolist())
+        points = [Point(*p) for p in self.vertices[i].tolist()]
+        return Facet(normal, points)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+class SweepIndex:
+    ''' Facets sorted by their lowest z, swept upwards layer by layer.
+
+    Facets enter the active set once the sweep reaches their lowest z and 
+    are retired once they are below the last finished layer, so each layer 
+    only looks at the facets near it. The order of the facets by lowest z 
+    can be given when it is already known.
+    '''
+    def __init__(self, vertices, order=None):
+        zs = vertices[:, :, 2]
+        self.minz = zs.min(axis=1)
+        self.maxz = zs.max(axis=1)
+        if order is None:
+            order = numpy.argsort(self.minz, kind='mergesort')
+        self.order = order
+        self.sorted_minz = self.minz[self.order]
+        self.next = 0
+        self.active = numpy.zeros(0, dtype=numpy.intp)
+
+    def facets_at(self, z, lastz):
+        ''' Sorted indices of the facets spanning z, z must be >= lastz'''
+        end = numpy.searchsorted(self.sorted_minz, z, side='right')
+        if end > self.next:
+            entering = self.order[self.next:end]
+            self.active = numpy.concatenate((self.active, entering))
+            self.next = end
+        
+        active = self.active[self.maxz[self.active] >= lastz]
+        self.active = active
+        spanned = active[(self.minz[active] <= z) & (self.maxz[active] >= z)]
+        spanned.sort()
+        return spanned
+
+class Layer:
+    colors = ([1, 0, 1], [0, 1, 1], [1, 1, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1])
+
+    def __init__(self, z, pitch):
+        self.lines = []
+        self.z = z
+        self.pitch = pitch
+
+    def empty(self):
+        return len(self.lines) == 0
+
+    def line_arrays(self):
+        ''' Vertices and colors of the lines as float32 (n, 3) arrays, two 
+        vertices per line. The chunks take the colors in turn, loops are 
+        white and come last, so they are drawn on top.
+        '''
+        counts, points = path_points(self.chunks + self.loops)
+        colors = [self.colors[i % len(self.colors)] for i in xrange(len(self.chunks))]
+        colors += [[1, 1, 1]] * len(self.loops)
+        colors = numpy.array(colors, dtype=numpy.float32).reshape(-1, 3)
+        colors = numpy.repeat(colors, 2 * counts, axis=0)
+        return points.reshape(-1, 3).astype(numpy.float32), colors
+
+    def set_lines(self, lines):
+        self.lines = lines
+        ok = self.createLoops()
+        if not ok:
+            return False
+        
+        self.calc_dimension()             
+        self.create_scanlines()
+        self.create_chunks()
+        return True
+
+    def createLoops(self):
+        lines = self.lines
+        
+        # Index the segment ends by grid key, points within LIMIT of each 
+        # other have the same or a neighbouring key
+        ends = {}
+        for i, line in enumerate(lines):
+            for p in (line.p1, line.p2):
+                ends.setdefault(p.key[:2], []).append(i)
+        
+        used = [False] * len(lines)
+        last = len(lines) - 1
+        self.loops = []
+        self.rings = []
+        while True:
+            while last >= 0 and used[last]:
+                last -= 1
+            if last < 0:
+                break
+            
+            loop = []
+            line = lines[last]
+            used[last] = True
+            loop.append(line)
+            
+            start = line.p1
+            p2 = line.p2
+            while True:
+                i = self.find_line(ends, used, p2)
+                if i is None:
+                    print 'error: loop is not found'
+                    return False
+                
+                used[i] = True
+                aline = lines[i]
+                if p2 == aline.p1:
+                    p1 = aline.p1
+                    p2 = aline.p2
+                else:
+                    p1 = aline.p2
+                    p2 = aline.p1
+                
+                loop.append(Line(p1, p2))
+                if p2 == start:
+                    break
+            
+            self.move_lines(loop)
+            nloop = self.merge_lines(loop)
+            self.loops.append(nloop)
+            
+            # Vertex ring of the loop: line i runs from vertex i to i + 1 
+            self.rings.append([line.p1 for line in nloop])
+        
+        del lines[:]
+        return True                
+    
+    def find_line(self, ends, used, p):
+        ''' First unused line with an end equal to p'''
+        cx, cy = p.key[:2]
+        found = None
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                for i in ends.get((x, y), ()):
+                    if used[i] or (found is not None and i > found):
+                        continue
+                    line = self.lines[i]
+                    if p == line.p1 or p == line.p2:
+                        found = i
+        return found
+    
+    def move_lines(self, loop):
+        tail = loop[-1]
+        k1 = tail.slope()
+        head = loop[0]
+        k2 = head.slope()
+        rm_list = []
+        if equal(k1, k2):
+            for aline in loop:
+                k = aline.slope()
+                if equal(k, k1):
+                    rm_list.append(aline)
+                else:
+                    break
+            
+            for it in rm_list:
+                loop.remove(it)
+            
+            loop.extend(rm_list)
+        
+        k1 = loop[0].slope()
+        k2 = loop[-1].slope()
+        assert not equal(k1, k2)
+
+    def merge_lines(self, loop):
+        nloop = []
+        while len(loop) != 0:
+            line = loop.pop(0) 
+            k1 = line.slope()
+            p1 = line.p1
+            p2 = line.p2
+            rm_list = []            
+            for aline in loop:
+                k2 = aline.slope()
+                if equal(k1, k2):
+                    p2 = aline.p2
+                    rm_list.append(aline)
+                else:
+                    p2 = aline.p1
+                    break
+            
+            for it in rm_list:
+                loop.remove(it)
+            nloop.append(Line(p1, p2))
+        
+        return nloop
+
+    def calc_dimension(self):
+        ylist = []
+        for loop in self.loops:
+            for line in loop:
+                ylist.append(line.p1.y)
+                ylist.append(line.p2.y)
+        self.miny = min(ylist)                
+        self.maxy = max(ylist)
+    
+    def create_edges(self):
+        ''' Edge table of the loop rings, sorted by their lowest y.
+
+        An edge is [miny, maxy, x, y, dxdy, ring, i] for the edge from
+        vertex i to i + 1 of ring, x is its crossing at y and is stepped 
+        along by dxdy as the scanline moves.
+        '''
+        edges = []
+        for ring in self.rings:
+            n = len(ring)
+            for i in range(n):
+                p1 = ring[i]
+                p2 = ring[(i + 1) % n]
+                if p1.y > p2.y:
+                    p1, p2 = p2, p1
+                
+                if equal(p1.x, p2.x) or equal(p1.y, p2.y):
+                    dxdy = 0.0
+                else:
+                    dxdy = (p2.x - p1.x) / (p2.y - p1.y)
+                edges.append([p1.y, p2.y, p1.x, p1.y, dxdy, ring, i])
+        
+        edges.sort(key=lambda edge: edge[0])
+        return edges
+
+    def create_scanlines(self):
+        self.scanlines = []
+        edges = self.create_edges()
+        active = []
+        next = 0
+        y = self.miny + self.pitch
+        while y < self.maxy:
+            # Edges enter the active table at their lowest y and leave it 
+            # once they are below the scanline
+            while next < len(edges) and edges[next][0] - LIMIT <= y:
+                active.append(edges[next])
+                next += 1
+            active = [edge for edge in active if edge[1] + LIMIT >= y]
+            code, scanline = self.create_one_scanline(y, active)
+            
+            if code == SCANLINE:
+                self.scanlines.append(scanline)
+            y += self.pitch
+    
+    def create_one_scanline(self, y, edges=None):
+        ''' Cross the scanline y with the edges.
+
+        Vertices on the scanline are handled as runs along the ring, found 
+        from the edge entering the run, see cross_run.
+        '''
+        if edges is None:
+            edges = self.create_edges()
+        
+        s = set()
+        for edge in edges:
+            miny, maxy, x, lasty, dxdy, ring, i = edge
+            if y < miny - LIMIT or y > maxy + LIMIT:
+                continue
+            
+            n = len(ring)
+            p1 = ring[i]
+            p2 = ring[(i + 1) % n]
+            on1 = equal(y, p1.y)
+            on2 = equal(y, p2.y)
+            if not on1 and not on2:
+                if miny <= y <= maxy:
+                    x += (y - lasty) * dxdy
+                    edge[2] = x
+                    edge[3] = y
+                    s.add(round(x, 6))
+            elif on2 and not on1:
+                for x in self.cross_run(y, ring, i):
+                    s.add(round(x, 6))
+        
+        xlist = list(s)
+        xlist.sort()                    
+
+        n = len(xlist)
+        ok = (n % 2 == 0)
+        if not ok:
+            print 'error: no of points in a scanline is not even', n
+            assert 0
+        
+        # Create lines
+        lines = []
+        for i in range(0, n, 2):
+            x1 = xlist[i]
+            x2 = xlist[i + 1]
+            p1 = Point(x1, y, self.z)
+            p2 = Point(x2, y, self.z)
+            line = Line(p1, p2)
+            lines.append(line)
+        
+        if len(lines) > 0:
+            code = SCANLINE
+        else:
+            code = NOT_SCANLINE
+        return (code, lines)
+
+    def cross_run(self, y, ring, i):
+        ''' Crossings x of the run of vertices on y that starts at i + 1.
+
+        The edges count on the scanline where they leave it upwards. A 
+        single vertex between two neighbours on the same side is a peak 
+        or valley and adds nothing. A horizontal run crosses at both ends 
+        if both neighbours are above, not at all if both are below, and 
+        otherwise where it meets the upper neighbour. So a scanline on a 
+        top edge of the model adds no line there.
+        '''
+        n = len(ring)
+        first = ring[(i + 1) % n]
+        last = first
+        for j in range(i + 2, i + n + 1):
+            p = ring[j % n]
+            if not equal(y, p.y):
+                break
+            last = p
+        else:
+            return []
+        
+        before = ring[i]
+        after = p
+        if (before.y - y) * (after.y - y) > 0.0:
+            if last is first or before.y < y:
+                return []
+            return [first.x, last.x]
+        
+        if after.y > y:
+            return [last.x]
+        else:
+            return [first.x]
+
+    def is_adjacent(self, scanline1, scanline2):
+        distance = abs(scanline2[0].p1.y - scanline1[0].p1.y)
+        return equal(distance, self.pitch) or distance < self.pitch
+
+    def overlap_ranges(self, scanline1, scanline2):
+        ''' For each line of scanline1 the index range of the lines of
+        scanline2 overlapping it, merging both sorted scanlines once'''
+        ranges = []
+        lo = 0
+        hi = 0
+        n = len(scanline2)
+        for line in scanline1:
+            while lo < n and scanline2[lo].p2.x <= line.p1.x:
+                lo += 1
+            while hi < n and scanline2[hi].p1.x < line.p2.x:
+                hi += 1
+            ranges.append((lo, hi))
+        return ranges
+
+    def create_chunks(self):
+        ''' Chain overlapping lines of adjacent scanlines into chunks.
+
+        A chunk starts at the leftmost free line of the first scanline 
+        with free lines left and takes the leftmost free overlapping line
+        of each following scanline until there is none.
+        '''
+        scanlines = [sorted(scanline, key=lambda line: line.p1.x) for scanline in self.scanlines]
+        m = len(scanlines)
+        overlaps = []
+        for k in range(m - 1):
+            if self.is_adjacent(scanlines[k], scanlines[k + 1]):
+                overlaps.append(self.overlap_ranges(scanlines[k], scanlines[k + 1]))
+            else:
+                overlaps.append(None)
+        
+        # free[k][i] leads to the first free line at or after i in scanline k 
+        free = [range(len(scanline) + 1) for scanline in scanlines]
+        def next_free(k, i):
+            L = free[k]
+            j = i
+            while L[j] != j:
+                j = L[j]
+            while L[i] != j:
+                L[i], i = j, L[i]
+            return j
+        
+        self.chunks = []
+        for k in range(m):
+            i = next_free(k, 0)
+            while i < len(scanlines[k]):
+                free[k][i] = i + 1
+                chunk = [scanlines[k][i]]
+                j = i
+                for kk in range(k, m - 1):
+                    if overlaps[kk] is None:
+                        break
+                    lo, hi = overlaps[kk][j]
+                    j = next_free(kk + 1, lo)
+                    if j >= hi:
+                        break
+                    free[kk + 1][j] = j + 1
+                    chunk.append(scanlines[kk + 1][j])
+                
+                self.chunks.append(chunk)
+                i = next_free(k, i)
+    
+    def write(self, f):
+        f.write(self.format())
+
+    def format(self):
+        ''' The layer as xml text, ready to be written in one go'''
+        out = ['<layer id=" %s ">\n' % self.id]
+        format_paths(out, 'loop', self.loops, self.z)
+        format_paths(out, 'chunk', self.chunks, self.z)
+        out.append('</layer>\n')
+        return ''.join(out)
+
+LINE_POINTS = operator.attrgetter('p1.x', 'p1.y', 'p1.z', 'p2.x', 'p2.y', 'p2.z')
+
+def path_points(paths):
+    ''' Number of lines of every path and their end points as (n, 2, 3) array'''
+    counts = numpy.fromiter((len(path) for path in paths), numpy.intp, len(paths))
+    lines = itertools.chain.from_iterable(paths)
+    values = itertools.chain.from_iterable(itertools.imap(LINE_POINTS, lines))
+    points = numpy.fromiter(values, numpy.float64, 6 * counts.sum())
+    return counts, points.reshape(-1, 2, 3)
+
+LINE_FORMAT = ('<line>\n'
+               '<point> <x> %s </x> <y> %s </y> <z> %s </z> </point>\n'
+               '<point> <x> %s </x> <y> %s </y> <z> %s </z> </point>\n'
+               '</line>\n')
+
+def format_paths(out, tag, paths, z):
+    ''' Append the xml of numbered loops or chunks of lines to out.
+
+    The coordinates of a path are pulled into one flat list and 
+    formatted with a single % operation. If all points of the path lie 
+    in plane z, z is formatted once instead of once per point.
+    '''
+    out.append('<%ss num=" %d ">\n' % (tag, len(paths)))
+    # Equal floats print the same, except 0.0 and -0.0
+    plane = z != 0.0
+    plane_format = LINE_FORMAT.replace('<z> %s </z>', '<z> %s </z>' % z)
+    count = 1
+    for path in paths:
+        values = list(itertools.chain.from_iterable(itertools.imap(LINE_POINTS, path)))
+        zs = values[2::3]
+        out.append('<%s id=" %d ">\n' % (tag, count))
+        if plane and zs.count(z) == len(zs):
+            del values[2::3]
+            out.append((plane_format * len(path)) % tuple(values))
+        else:
+            out.append((LINE_FORMAT * len(path)) % tuple(values))
+        out.append('</%s>\n' % tag)
+        count += 1
+    out.append('</%ss>\n' % tag)
+
+class Transform:
+    ''' Affine model transform held as a 4x4 matrix.
+
+    Transforms are built up step by step, every step returns a new 
+    transform applied after the previous ones:
+    
+        Transform().rotate('z', 30).scale(2).orient('-X')
+    '''
+    def __init__(self, matrix=None):
+        if matrix is None:
+            matrix = numpy.identity(4)
+        self.matrix = matrix
+
+    def then(self, matrix):
+        return Transform(numpy.dot(matrix, self.matrix))
+
+    def scale(self, factor):
+        m = numpy.identity(4)
+        m[0, 0] = m[1, 1] = m[2, 2] = factor
+        return self.then(m)
+
+    def orient(self, direction):
+        ''' Turn one of the six slicing directions onto +Z'''
+        axes, signs = DIRECTIONS[direction]
+        m = numpy.zeros((4, 4))
+        for i in range(3):
+            m[i, axes[i]] = signs[i]
+        m[3, 3] = 1.0
+        return self.then(m)
+
+    def rotate(self, axis, angle):
+        ''' Rotate by angle degrees about the x, y or z axis'''
+        i, j = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+        c = math.cos(math.radians(angle))
+        s = math.sin(math.radians(angle))
+        m = numpy.identity(4)
+        m[i, i] = c
+        m[i, j] = -s
+        m[j, i] = s
+        m[j, j] = c
+        return self.then(m)
+
+    def translate(self, dx, dy, dz):
+        m = numpy.identity(4)
+        m[:3, 3] = (dx, dy, dz)
+        return self.then(m)
+
+    def key(self):
+        return self.matrix.tostring()
+
+    def axes(self):
+        ''' Source axis and factor of each new axis if the transform only 
+        scales, flips and swaps axes, otherwise None'''
+        linear = self.matrix[:3, :3]
+        if (self.matrix[:3, 3] != 0.0).any() or ((linear != 0.0).sum(axis=1) != 1).any():
+            return None
+        axes = abs(linear).argmax(axis=1)
+        return axes, linear[range(3), axes]
+
+    def apply(self, vertices, normals, out_vertices, out_normals):
+        ''' Transform (n, 3, 3) vertices and (n, 3) normals into out_*'''
+        axes = self.axes()
+        if axes is not None:
+            # Exact and cheaper than the matrix product
+            axes, factors = axes
+            for i in range(3):
+                numpy.multiply(vertices[:, :, axes[i]], factors[i], out=out_vertices[:, :, i])
+                numpy.multiply(normals[:, axes[i]], cmp(factors[i], 0), out=out_normals[:, i])
+            return
+        
+        linear = self.matrix[:3, :3]
+        points = out_vertices.reshape(-1, 3)
+        numpy.dot(vertices.reshape(-1, 3).astype(numpy.float64), linear.T, out=points)
+        points += self.matrix[:3, 3]
+        
+        # Normals transform with the inverse transpose, then renormalize
+        numpy.dot(normals.astype(numpy.float64), numpy.linalg.inv(linear), out=out_normals)
+        length = numpy.sqrt((out_normals * out_normals).sum(axis=1))
+        length[length == 0.0] = 1.0
+        out_normals /= length[:, numpy.newaxis]
+
+class MeshStats:
+    ''' Bounds, surface area, signed volume and number of facets, 
+    accumulated block by block.
+    '''
+    def __init__(self):
+        self.lower = None
+        self.upper = None
+        self.area = 0.0
+        self.volume = 0.0
+        self.count = 0
+
+    def add(self, vertices):
+        if len(vertices) == 0:
+            return
+        
+        block = numpy.asarray(vertices, dtype=numpy.float64)
+        points = block.reshape(-1, 3)
+        if self.lower is None:
+            self.lower = points.min(axis=0)
+            self.upper = points.max(axis=0)
+        else:
+            numpy.minimum(self.lower, points.min(axis=0), self.lower)
+            numpy.maximum(self.upper, points.max(axis=0), self.upper)
+        
+        p0 = block[:, 0]
+        cross = numpy.cross(block[:, 1] - p0, block[:, 2] - p0)
+        self.area += float(numpy.sqrt((cross * cross).sum(axis=1)).sum()) / 2
+        # Signed volume of the tetrahedra spanned with the origin
+        self.volume += float((p0 * numpy.cross(block[:, 1], block[:, 2])).sum()) / 6
+        self.count += len(block)
+
+class FacetBuckets:
+    ''' Facets spilled to temporary files by bands of z.
+
+    Band b holds every facet reaching into [b * size - pad, (b + 1) * size + pad],
+    so the layers of a band can be sliced from its file alone.
+    '''
+    def __init__(self, size, pad):
+        self.size = size
+        self.pad = pad
+        self.dir = tempfile.mkdtemp(prefix='blackcat')
+        self.counts = {}
+
+    def path(self, band):
+        return os.path.join(self.dir, '%d.bin' % band)
+
+    def add(self, vertices):
+        ''' Append (n, 3, 3) facets to the files of the bands they reach'''
+        zs = vertices[:, :, 2]
+        first = numpy.floor((zs.min(axis=1) - self.pad) / self.size).astype(numpy.int64)
+        last = numpy.floor((zs.max(axis=1) + self.pad) / self.size).astype(numpy.int64)
+        
+        # One entry per facet and band, grouped by band in facet order
+        counts = last - first + 1
+        facets = numpy.repeat(numpy.arange(len(vertices)), counts)
+        offsets = numpy.arange(len(facets)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        bands = numpy.repeat(first, counts) + offsets
+        order = numpy.argsort(bands, kind='mergesort')
+        bands = bands[order]
+        facets = facets[order]
+        
+        keys, starts = numpy.unique(bands, return_index=True)
+        ends = numpy.append(starts[1:], len(bands))
+        for band, start, end in zip(keys.tolist(), starts.tolist(), ends.tolist()):
+            f = open(self.path(band), 'ab')
+            try:
+                numpy.asarray(vertices[facets[start:end]], dtype=numpy.float64).tofile(f)
+            finally:
+                f.close()
+            self.counts[band] = self.counts.get(band, 0) + end - start
+
+    def load(self, band):
+        ''' The (n, 3, 3) facets of a band'''
+        if band not in self.counts:
+            return numpy.zeros((0, 3, 3))
+        return numpy.fromfile(self.path(band), dtype=numpy.float64).reshape(-1, 3, 3)
+
+    def close(self):
+        shutil.rmtree(self.dir, True)
+
+def slice_writer(filename, model, num=None):
+    ''' Writer for a binary slice file if filename ends in SLICE_EXT, 
+    gzip compressed xml for .gz and plain xml otherwise.
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == SLICE_EXT:
+        return BinarySliceWriter(filename, model)
+    return XmlSliceWriter(filename, model, num, ext == '.gz')
+
+class XmlSliceWriter:
+    ''' Write the slice xml file one layer at a time.
+
+    If the number of layers is not known up front, the layers go to a 
+    temporary file next to filename first. close() then writes the head 
+    with the number of layers and copies the layers after it.
+    '''
+    def __init__(self, filename, model, num=None, compress=False):
+        self.filename = filename
+        self.compress = compress
+        self.num = num
+        self.count = 0
+        self.head = ('<slice>\n'
+                     '    <dimension>\n'
+                     '        <x> %s </x>\n'
+                     '        <y> %s </y>\n'
+                     '        <z> %s </z>\n'
+                     '    </dimension>\n'
+                     '    <para>\n'
+                     '         <layerheight> %s </layerheight>\n'
+                     '         <layerpitch> %s </layerpitch>\n'
+                     '         <speed> %s </speed>\n'
+                     '    </para>\n' % (model.xsize, model.ysize, model.zsize, 
+                                        model.height, model.pitch, model.speed))
+        if num is None:
+            directory = os.path.dirname(os.path.abspath(filename))
+            self.f = tempfile.TemporaryFile(dir=directory)
+        else:
+            self.f = self.open()
+            self.write_head(self.f, num)
+
+    def open(self):
+        if self.compress:
+            return gzip.open(self.filename, 'wb', SLICE_GZIP_LEVEL)
+        else:
+            return open(self.filename, 'w', SLICE_WRITE_BUFFER)
+
+    def write_head(self, f, num):
+        f.write(self.head)
+        print >> f, '<layers num="', num, '">'
+
+    def write(self, layer):
+        layer.write(self.f)
+        self.count += 1
+
+    def close(self):
+        f = self.f
+        print >> f, '</layers>'
+        print >> f, '</slice>'
+        if self.num is None:
+            f.seek(0)
+            out = self.open()
+            try:
+                self.write_head(out, self.count)
+                shutil.copyfileobj(f, out, SLICE_WRITE_BUFFER)
+            finally:
+                out.close()
+        f.close()
+
+class BinarySliceWriter:
+    ''' Write the binary slice file one layer at a time.
+
+    After the header come the layers, each a SLICE_LAYER record, the 
+    number of lines of every loop and chunk as uint32 and the points of 
+    the lines as float32, or float64 to keep them exactly. The offsets 
+    of the layers follow as an uint64 index, its position is filled 
+    into the header by close().
+    '''
+    def __init__(self, filename, model, size=4):
+        self.f = open(filename, 'wb', SLICE_WRITE_BUFFER)
+        self.size = size
+        self.dtype = SLICE_COORDINATES[size]
+        self.para = (model.xsize, model.ysize, model.zsize, 
+                     model.height, model.pitch, model.speed)
+        self.offsets = []
+        self.count = 0
+        self.f.write(self.header(0))
+
+    def header(self, index):
+        return SLICE_HEADER.pack(SLICE_MAGIC, SLICE_VERSION, self.size, self.count, 
+                                 *(self.para + (index,)))
+
+    def write(self, layer):
+        f = self.f
+        self.offsets.append(f.tell())
+        counts, points = path_points(layer.loops + layer.chunks)
+        f.write(SLICE_LAYER.pack(layer.z, len(layer.loops), len(layer.chunks)))
+        f.write(counts.astype('<u4').tostring())
+        f.write(points.astype(self.dtype).tostring())
+        self.count += 1
+
+    def close(self):
+        f = self.f
+        index = f.tell()
+        f.write(numpy.array(self.offsets, dtype='<u8').tostring())
+        f.seek(0)
+        f.write(self.header(index))
+        f.close()
+
+class SliceFile:
+    ''' Layers of a binary slice file, memory mapped for random access'''
+    def __init__(self, filename):
+        self.data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+        if len(self.data) < SLICE_HEADER.size:
+            raise FormatError, 'not a slice file'
+        
+        header = SLICE_HEADER.unpack(self.data[:SLICE_HEADER.size].tostring())
+        magic, version, size, num = header[:4]
+        if magic != SLICE_MAGIC:
+            raise FormatError, 'not a slice file'
+        if version != SLICE_VERSION or size not in SLICE_COORDINATES:
+            raise FormatError, 'slice file version %d' % version
+        
+        self.size = size
+        self.dtype = SLICE_COORDINATES[size]
+        self.xsize, self.ysize, self.zsize, self.height, self.pitch, self.speed = header[4:10]
+        index = header[10]
+        self.offsets = self.data[index:index + 8 * num].view('<u8')
+        if len(self.offsets) != num:
+            raise FormatError, 'truncated slice file'
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def arrays(self, i):
+        ''' z and the loops and chunks of layer i as (n, 2, 3) point arrays'''
+        start = int(self.offsets[i])
+        end = start + SLICE_LAYER.size
+        z, nloops, nchunks = SLICE_LAYER.unpack(self.data[start:end].tostring())
+        
+        start = end
+        end = start + 4 * (nloops + nchunks)
+        counts = self.data[start:end].view('<u4')
+        ends = numpy.cumsum(counts).tolist()
+        
+        start = end
+        end = start + 6 * self.size * (ends[-1] if ends else 0)
+        points = self.data[start:end].view(self.dtype).reshape(-1, 2, 3)
+        paths = [points[first:last] for first, last in zip([0] + ends[:-1], ends)]
+        return z, paths[:nloops], paths[nloops:]
+
+    def layer(self, i):
+        ''' Layer i rebuilt with its loops and chunks of lines'''
+        z, loops, chunks = self.arrays(i)
+        return build_layer(i, z, self.pitch, loops, chunks)
+
+    def close(self):
+        ''' Drop the mapping, it is unmapped with its last array'''
+        self.data = None
+        self.offsets = []
+
+class XmlSliceFile:
+    ''' Layers of a slice xml file.
+
+    Opening only indexes where the layers start, a layer is parsed when 
+    it is asked for. A compressed file is unpacked to a temporary file 
+    first.
+    '''
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        if filename.lower().endswith('.gz'):
+            plain = tempfile.TemporaryFile()
+            try:
+                shutil.copyfileobj(gzip.GzipFile(fileobj=f), plain, SLICE_WRITE_BUFFER)
+            finally:
+                f.close()
+            f = plain
+        
+        self.f = f
+        self.data = None
+        try:
+            self.read_index()
+        except:
+            self.close()
+            raise
+
+    def read_index(self):
+        f = self.f
+        f.seek(0, 2)
+        if f.tell() == 0:
+            raise FormatError, 'not a slice file'
+        self.data = data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = data.find('<layers')
+        if not data[:7] == '<slice>' or start == -1:
+            raise FormatError, 'not a slice file'
+        
+        header = data[:start]
+        values = []
+        for tag in ('x', 'y', 'z', 'layerheight', 'layerpitch', 'speed'):
+            match = re.search(r'<%s> (\S+) </%s>' % (tag, tag), header)
+            if not match:
+                raise FormatError, 'no %s in slice file' % tag
+            values.append(float(match.group(1)))
+        self.xsize, self.ysize, self.zsize, self.height, self.pitch, self.speed = values
+        
+        self.offsets = []
+        pos = data.find('<layer id=', start)
+        while pos != -1:
+            self.offsets.append(pos)
+            pos = data.find('<layer id=', pos + 1)
+        end = data.rfind('</layers>')
+        if end == -1:
+            raise FormatError, 'truncated slice file'
+        self.offsets.append(end)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def arrays(self, i):
+        ''' z and the loops and chunks of layer i as (n, 2, 3) point arrays'''
+        text = self.data[self.offsets[i]:self.offsets[i + 1]]
+        loops, chunks = text.split('<chunks num=')
+        loops = [xml_points(path) for path in loops.split('</loop>')[:-1]]
+        chunks = [xml_points(path) for path in chunks.split('</chunk>')[:-1]]
+        z = 0.0
+        for path in loops + chunks:
+            if len(path):
+                z = float(path[0, 0, 2])
+                break
+        return z, loops, chunks
+
+    def layer(self, i):
+        ''' Layer i rebuilt with its loops and chunks of lines'''
+        z, loops, chunks = self.arrays(i)
+        return build_layer(i, z, self.pitch, loops, chunks)
+
+    def close(self):
+        ''' Unmap and close the file, an unpacked copy goes with it'''
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.f.close()
+
+def xml_points(text):
+    ''' The points of the lines in xml text as (n, 2, 3) array'''
+    values = list(itertools.chain.from_iterable(XML_POINT.findall(text)))
+    return numpy.array(map(float, values)).reshape(-1, 2, 3)
+
+def read_slice_file(filename):
+    ''' Open a slice file for reading, binary or xml'''
+    if os.path.splitext(filename)[1].lower() == SLICE_EXT:
+        return SliceFile(filename)
+    return XmlSliceFile(filename)
+
+def build_layer(i, z, pitch, loops, chunks):
+    ''' Layer i, counted from 0, from the point arrays of its paths'''
+    layer = Layer(z, pitch)
+    layer.id = i + 1
+    layer.loops = [path_lines(path) for path in loops]
+    layer.chunks = [path_lines(path) for path in chunks]
+    return layer
+
+def path_lines(points):
+    ''' Lines of a (n, 2, 3) point array'''
+    return [Line(Point(*p1), Point(*p2)) for p1, p2 in points.tolist()]
+
+class SliceLayers:
+    ''' Read only sequence of the layers of a slice file.
+
+    A layer is decoded when it is accessed, only the last one is kept.
+    '''
+    def __init__(self, slices):
+        self.slices = slices
+        self.index = None
+        self.layer = None
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __getitem__(self, i):
+        n = len(self.slices)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError, 'layer index out of range'
+        if i != self.index:
+            self.layer = self.slices.layer(i)
+            self.index = i
+        return self.layer
+
+    def close(self):
+        self.slices.close()
+        self.index = None
+        self.layer = None
+
+    def __iter__(self):
+        for i in xrange(len(self.slices)):
+            yield self.slices.layer(i)
+
+class SliceCache:
+    ''' Slice results kept on disk as binary slice files.
+
+    An entry is keyed by a hash of the facets and the slice parameters 
+    that change the layers. Reading an entry marks it as used, the least 
+    recently used entries go once the files exceed max_size bytes.
+    '''
+    def __init__(self, directory=SLICE_CACHE_DIR, max_size=SLICE_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, mesh_hash, para):
+        items = [mesh_hash]
+        for name in SLICE_CACHE_KEYS:
+            value = para.get(name, "")
+            try:
+                value = repr(float(value))
+            except ValueError:
+                pass
+            items.append('%s=%s' % (name, value))
+        return hashlib.sha1(' '.join(items)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SLICE_EXT)
+
+    def get(self, key):
+        ''' The slice file of key, None if there is none'''
+        path = self.path(key)
+        try:
+            self.touch(path)
+        except OSError, e:
+            return None
+        return path
+
+    def put(self, key, model):
+        ''' Store the layers of model under key'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        
+        path = self.path(key)
+        tmp = path + '.tmp'
+        writer = BinarySliceWriter(tmp, model, 8)
+        try:
+            for layer in model.layers:
+                writer.write(layer)
+        finally:
+            writer.close()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        self.touch(path)
+        self.evict()
+
+    def touch(self, path):
+        ''' Mark path as used now, more finely than the file system clock'''
+        now = time.time()
+        os.utime(path, (now, now))
+
+    def evict(self):
+        ''' Remove the least recently used files above max_size'''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SLICE_EXT):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError, e:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        
+        entries.sort()
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError, e:
+                pass
+
+def mesh_hash(normals, vertices):
+    ''' sha1 of the facet data'''
+    h = hashlib.sha1(str(vertices.shape))
+    for start in xrange(0, len(vertices), STATS_BLOCK_SIZE):
+        end = start + STATS_BLOCK_SIZE
+        h.update(numpy.ascontiguousarray(vertices[start:end]).data)
+        h.update(numpy.ascontiguousarray(normals[start:end]).data)
+    return h.hexdigest()
+
+class CadModel:
+    def __init__(self):
+        self.init_logger()
+        self.loaded = False
+        self.curr_layer = -1
+        self.sliced = False
+        self.dimension = {}
+        self.work = None
+        self.transform_key = None
+        self.stats_key = None
+        self.mesh_hash = None
+        self.cache = None
+        self.layers = []
+        self.layers_version = 0
+        self.facets_version = 0
+        self.facets_key = None
+    
+    def next_layer(self):
+        n = len(self.layers)
+        self.curr_layer = (self.curr_layer + 1) % len(self.layers)
+    
+    def prev_layer(self):
+        n = len(self.layers)
+        self.curr_layer -= 1
+        if self.curr_layer == -1:
+            self.curr_layer = len(self.layers) -1
+
+    def get_curr_layer(self):
+        return self.layers[self.curr_layer]
+
+    def close_layers(self):
+        ''' Drop the layers, closing the slice file they are read from'''
+        if isinstance(self.layers, SliceLayers):
+            self.layers.close()
+        self.layers = []
+
+    def init_logger(self):
+        #self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger = logging.getLogger("cadmodel")
+        self.logger.setLevel(logging.DEBUG)
+        # The logger is shared by all models, its handler is added once
+        if self.logger.handlers:
+            return
+        h = logging.StreamHandler()
+        h.setLevel(logging.DEBUG)
+        f = logging.Formatter("%(levelname)s %(filename)s:%(lineno)d %(message)s")
+        h.setFormatter(f)
+        self.logger.addHandler(h)
+    
+    def get_line(self, f):
+        line = f.readline()
+        if not line:
+            raise EndFileException, 'end of file'
+        return line.strip()
+
+    def get_solid_line(self, f):
+        ''' Read the first line'''
+        line = self.get_line(f)
+        items = line.split()
+        no = len(items)
+        if no >= 2 and items[0] == 'solid':
+            self.modelName = items[1]
+        else:
+            self.logger.error(line)
+            raise FormatError, line
+    
+    def set_facets(self, normals, vertices, key):
+        ''' Store the facets as (n, 3) normal and (n, 3, 3) vertex arrays.
+
+        key is the key of the transform the facets are under. The facets
+        version only counts changes of the geometry, not new copies of it.
+        '''
+        self.normals = normals
+        self.vertices = vertices
+        self.facets = FacetList(normals, vertices)
+        if key != self.facets_key:
+            self.facets_version += 1
+            self.facets_key = key
+
+    def calc_dimension(self):
+        ''' Bounds, center, diameter, surface area, volume and facet count.
+
+        One sweep over the vertex array in blocks of STATS_BLOCK_SIZE
+        facets. The result is kept until the transform changes.
+        '''
+        if not self.loaded:
+            return
+        if self.stats_key is not None and self.stats_key == self.transform_key:
+            return
+        
+        stats = MeshStats()
+        for start in xrange(0, len(self.vertices), STATS_BLOCK_SIZE):
+            stats.add(self.vertices[start:start + STATS_BLOCK_SIZE])
+        self.set_stats(stats)
+        self.stats_key = self.transform_key
+
+    def set_stats(self, stats):
+        self.minx, self.miny, self.minz = stats.lower.tolist()
+        self.maxx, self.maxy, self.maxz = stats.upper.tolist()
+        
+        self.xsize = self.maxx - self.minx
+        self.ysize = self.maxy - self.miny
+        self.zsize = self.maxz - self.minz
+
+        self.diameter = math.sqrt(self.xsize * self.xsize + self.ysize * self.ysize + self.zsize * self.zsize)
+
+        # Center
+        self.xcenter = (self.minx + self.maxx) / 2
+        self.ycenter = (self.miny + self.maxy) / 2
+        self.zcenter = (self.minz + self.maxz) / 2
+
+        self.area = stats.area
+        self.volume = stats.volume
+        self.facet_count = stats.count
+
+    def read_ascii(self, f):
+        ''' Parse the facets of an ASCII STL file'''
+        normals = []
+        vertices = []
+        for normal, points in self.iter_ascii(f):
+            normals.append(normal)
+            vertices.append(points)
+        
+        if not vertices:
+            return numpy.zeros((0, 3)), numpy.zeros((0, 3, 3))
+        return numpy.concatenate(normals), numpy.concatenate(vertices)
+
+    def iter_ascii(self, f):
+        ''' Generate the facets of an ASCII STL file block by block'''
+        try:
+            self.get_solid_line(f)
+        except EndFileException, e:
+            return
+        
+        rest = ''
+        ended = False
+        while not ended:
+            data = f.read(STL_BLOCK_SIZE)
+            if data:
+                # Only split on whole facets, keep the tail for the next block
+                block = rest + data
+                end = block.rfind('endfacet')
+                if end == -1:
+                    rest = block
+                    continue
+                end += len('endfacet')
+                rest = block[end:]
+                tokens = block[:end].split()
+            else:
+                tokens = rest.split()
+
+            if 'endsolid' in tokens:
+                tokens = tokens[:tokens.index('endsolid')]
+                ended = True
+            
+            facets = self.parse_facets(tokens)
+            # The model counts as loaded once its last block has parsed
+            if ended:
+                self.loaded = True
+            yield facets
+            if not data:
+                break
+
+    def read_blocks(self, f):
+        ''' Generate the facets of an STL file as (normals, vertices) blocks'''
+        if is_binary_stl(f):
+            normals, vertices = self.read_binary(f)
+            for start in xrange(0, len(vertices), STATS_BLOCK_SIZE):
+                end = start + STATS_BLOCK_SIZE
+                yield normals[start:end], vertices[start:end]
+        else:
+            for block in self.iter_ascii(f):
+                yield block
+
+    def parse_facets(self, tokens):
+        ''' Convert the tokens of whole facets to normal and vertex arrays'''
+        size = len(STL_FACET_TOKENS)
+        n = len(tokens) // size
+        if n * size != len(tokens):
+            self.format_error(tokens)
+        
+        facets = numpy.array(tokens, dtype=object).reshape(n, size)
+        for i, word in enumerate(STL_FACET_TOKENS):
+            if word is not None and (facets[:, i] != word).any():
+                self.format_error(tokens)
+        
+        try:
+            numbers = facets[:, STL_NUMBER_COLUMNS].astype(numpy.float64)
+        except ValueError, e:
+            self.format_error(tokens)
+        return numbers[:, :3], numbers[:, 3:].reshape(n, 3, 3)
+
+    def format_error(self, tokens):
+        ''' Find the first malformed line of facet tokens and report it'''
+        size = len(STL_FACET_TOKENS)
+        for pos in xrange(len(tokens)):
+            word = STL_FACET_TOKENS[pos % size]
+            if word is None:
+                try:
+                    float(tokens[pos])
+                except ValueError, e:
+                    break
+            elif tokens[pos] != word:
+                break
+        else:
+            pos = len(tokens)
+        
+        if pos == len(tokens):
+            line = 'unexpected end of file'
+        else:
+            slot = pos % size
+            start = max([i for i in STL_FACET_LINES if i <= slot])
+            end = min([i for i in STL_FACET_LINES + (size,) if i > slot])
+            first = pos - slot
+            line = ' '.join(tokens[first + start:first + end])
+        self.logger.error(line)
+        raise FormatError, line
+
+    def read_binary(self, f):
+        ''' Map the facet records of a binary STL file without copying them'''
+        header = f.read(STL_HEADER_SIZE)
+        self.modelName = header[:80].strip('\0 ')
+        n = struct.unpack('<I', header[80:])[0]
+        if n == 0:
+            self.logger.error('no facets')
+            raise FormatError, 'no facets'
+        
+        records = numpy.memmap(f, dtype=STL_RECORD, mode='r', 
+                               offset=STL_HEADER_SIZE, shape=(n,))
+        self.loaded = True
+        return records['normal'], records['vertices']
+
+    def open(self, filename):
+        start = time.time()
+        try:
+            f = open(filename, 'rb') 
+        except IOError, e:
+            print e
+            return False
+        
+        self.loaded = False
+        try:
+            if is_binary_stl(f):
+                normals, vertices = self.read_binary(f)
+            else:
+                normals, vertices = self.read_ascii(f)
+        except FormatError, e:
+            print e
+            self.loaded = False
+            return False
+        finally:
+            f.close()
+        
+        if self.loaded and len(vertices) == 0:
+            self.loaded = False
+
+        if self.loaded:
+            self.facets_key = None
+            self.set_facets(normals, vertices, Transform().key())
+            self.work = None
+            # Float64 facets as read can be sliced as they are, float32 ones
+            # from binary files are copied to float64 first
+            self.transform_key = None
+            if vertices.dtype == numpy.float64:
+                self.transform_key = self.facets_key
+            self.stats_key = None
+            self.mesh_hash = None
+            self.calc_dimension()
+            self.logger.debug("no of facets:" + str(self.facet_count))
+            self.logger.debug("area: %f volume: %f" % (self.area, self.volume))
+            normals.setflags(write=False)
+            vertices.setflags(write=False)
+            self.oldnormals = normals
+            self.oldvertices = vertices
+            self.sliced = False
+            self.close_layers()
+            self.set_old_dimension()
+            cpu = '%.1f' % (time.time() - start)
+            
+            print 'open cpu', cpu, 'secs'
+            return True
+        else:
+            return False
+    
+    def open_slices(self, filename):
+        ''' View the layers of a saved slice file instead of a model.
+
+        Only the header and the layer index are read here, the layers 
+        are decoded one at a time as they are viewed.
+        '''
+        try:
+            slices = read_slice_file(filename)
+        except (IOError, FormatError, ValueError), e:
+            print e
+            return False
+        
+        n = len(slices)
+        if n == 0:
+            slices.close()
+            return False
+        
+        self.height = slices.height
+        self.pitch = slices.pitch
+        self.speed = slices.speed
+        self.xsize = slices.xsize
+        self.ysize = slices.ysize
+        self.zsize = slices.zsize
+        self.diameter = math.sqrt(self.xsize * self.xsize + self.ysize * self.ysize + self.zsize * self.zsize)
+        
+        # The files keep no position, center on the bottom, middle and top layers
+        points = []
+        zs = []
+        for i in sorted(set([0, n // 2, n - 1])):
+            z, loops, chunks = slices.arrays(i)
+            zs.append(z)
+            points.extend([path.reshape(-1, 3) for path in loops])
+        points = numpy.concatenate(points)
+        lower = points.min(axis=0)
+        upper = points.max(axis=0)
+        self.xcenter = float(lower[0] + upper[0]) / 2
+        self.ycenter = float(lower[1] + upper[1]) / 2
+        self.zcenter = (zs[0] + zs[-1]) / 2
+        
+        self.loaded = False
+        self.layers_version += 1
+        self.close_layers()
+        self.layers = SliceLayers(slices)
+        self.curr_layer = 0
+        self.sliced = True
+        self.dimension = {"oldx":"", "oldy":"", "oldz":""}
+        self.set_new_dimension()
+        return True
+
+    def save(self, filename):
+        writer = slice_writer(filename, self, len(self.layers))
+        for layer in self.layers:
+            writer.write(layer)
+        writer.close()
+
+    def set_parameter(self, para):
+        ''' Take over the slice parameters, returns the model transform'''
+        self.height = float(para["height"])
+        self.pitch = float(para["pitch"])
+        self.speed = float(para["speed"])
+        self.fast = float(para["fast"])
+        self.direction = para["direction"]
+        self.scale = float(para["scale"])
+        self.processes = int(float(para.get("processes", 1)))
+        self.angles = [float(para.get(key, 0)) for key in ("xangle", "yangle", "zangle")]
+        
+        transform = Transform()
+        for axis, angle in zip("xyz", self.angles):
+            if angle:
+                transform = transform.rotate(axis, angle)
+        return transform.scale(self.scale).orient(self.direction)
+
+    def slice(self, para):
+        self.sliced = False
+        self.close_layers()
+        self.layers_version += 1
+        transform = self.set_parameter(para)
+        self.transform_model(transform)
+        self.calc_dimension()
+        if self.cache is not None and self.load_cached_layers(para):
+            self.queue.put(len(self.layers))
+        else:
+            self.create_layers()
+            if self.cache is not None and len(self.layers) > 0:
+                try:
+                    self.cache.put(self.cache_key, self)
+                except (IOError, OSError), e:
+                    print e
+        self.set_new_dimension()
+        if len(self.layers) > 0:
+            self.curr_layer = 0
+            self.sliced = True
+        else:
+            self.sliced = False
+        # Only now the layers are ready for whoever waits on the queue
+        self.queue.put("done")
+        return self.sliced
+
+    def load_cached_layers(self, para):
+        ''' Take the layers from the slice cache if they are there'''
+        if self.mesh_hash is None:
+            self.mesh_hash = mesh_hash(self.oldnormals, self.oldvertices)
+        self.cache_key = self.cache.key(self.mesh_hash, para)
+        path = self.cache.get(self.cache_key)
+        if path is None:
+            return False
+        
+        try:
+            slices = SliceFile(path)
+        except (IOError, FormatError), e:
+            print e
+            return False
+        
+        self.layers = SliceLayers(slices)
+        print 'no of layers:', len(self.layers), 'from', path
+        return True
+
+    def export(self, para, filename):
+        ''' Slice the model straight into a slice file.
+
+        Every layer is written as soon as it is done and then dropped, 
+        nothing is kept for viewing. Returns the number of layers written.
+        '''
+        self.sliced = False
+        self.close_layers()
+        transform = self.set_parameter(para)
+        self.transform_model(transform)
+        self.calc_dimension()
+        writer = slice_writer(filename, self)
+        try:
+            self.create_layers(writer)
+        finally:
+            writer.close()
+        self.set_new_dimension()
+        self.queue.put("done")
+        return writer.count
+    
+    def set_old_dimension(self):
+        self.dimension["oldx"] = str(self.xsize)
+        self.dimension["oldy"] = str(self.ysize)
+        self.dimension["oldz"] = str(self.zsize)
+        self.dimension["newx"] = ""
+        self.dimension["newy"] = ""
+        self.dimension["newz"] = ""
+
+    def set_new_dimension(self):
+        self.dimension["newx"] = str(self.xsize)
+        self.dimension["newy"] = str(self.ysize)
+        self.dimension["newz"] = str(self.zsize)
+
+    def transform_model(self, transform):
+        ''' Apply transform to the original facets.
+
+        The original arrays stay untouched, the result goes into working
+        buffers which are reused from one slice to the next and kept 
+        as long as the transform does not change.
+        '''
+        key = transform.key()
+        if key == self.transform_key:
+            return
+        
+        old = self.oldvertices
+        if self.work is None or self.work.shape != old.shape:
+            self.work = numpy.empty(old.shape)
+            self.work_normals = numpy.empty(self.oldnormals.shape)
+        
+        transform.apply(old, self.oldnormals, self.work, self.work_normals)
+        self.transform_key = key
+        self.set_facets(self.work_normals, self.work, key)
+    
+    def create_layers(self, writer=None):
+        ''' Slice the layers into self.layers, or hand them to writer 
+        one by one without keeping them. The caller puts "done" on the 
+        queue once it has finished with the layers.
+        '''
+        start = time.time()
+        no = (self.maxz - self.minz) / self.height
+        no = int(no)
+        self.queue.put(no)
+        if self.processes > 1 and no > 1:
+            self.layers = self.create_layers_parallel(no, writer)
+        else:
+            z = self.minz + self.height
+            self.layers, ok = self.create_band(z, self.minz, self.maxz, no, writer)
+        
+        if writer is None:
+            print 'no of layers:', len(self.layers)
+        else:
+            print 'no of layers:', writer.count
+        cpu = '%.1f' % (time.time() - start)
+        print 'slice cpu', cpu,'secs'
+    
+    def create_band(self, z, lastz, top, no=0, writer=None, order=None):
+        ''' Slice layers from z up to top, returns (layers, ok).
+
+        Progress goes to self.queue when the total number of layers no
+        is given. With a writer the layers are written instead of 
+        returned. ok is False if a layer could not be created. order is
+        the order of the facets by lowest z, if known, see SweepIndex.
+        '''
+        layers = []
+        count = 0
+        for code, z, layer in self.sweep_layers(z, lastz, top, self.vertices, order):
+            if code == LAYER:
+                count += 1
+                layer.id = count
+                if writer is None:
+                    layers.append(layer)
+                else:
+                    writer.write(layer)
+                if no:
+                    self.queue.put(count)
+                    print 'layer', count, '/', no
+            elif code == ERROR:
+                return (layers, False)
+        
+        return (layers, True)
+
+    def sweep_layers(self, z, lastz, top, vertices, order=None):
+        ''' Generate (code, z, layer) for the planes from z up to top.
+
+        After a LAYER or NOT_LAYER the next plane is z + height. A REDO 
+        moves the plane down a little and tries again, the sweep ends 
+        with ERROR when that runs into the last plane.
+        '''
+        sweep = SweepIndex(vertices, order)
+        while z > self.minz and z <= top:
+            code, layer = self.create_one_layer(z, sweep.facets_at(z, lastz), vertices)
+            if code == REDO:
+                z = z - self.height * 0.01
+                if z < lastz:
+                    yield (ERROR, z, None)
+                    return
+                print 'recreate layer'
+                continue
+            
+            yield (code, z, layer)
+            if code == ERROR:
+                return
+            lastz = z
+            z += self.height
+
+    def slice_file(self, filename, para, outname, band_layers=STREAM_BAND_LAYERS):
+        ''' Slice an STL file into a slice file without loading the model.
+
+        One pass over the STL file transforms the facets and spills them 
+        into bands of band_layers layers. The bands are then sliced in 
+        turn and every layer is written as soon as it is done, so only 
+        one band of facets is in memory at a time.
+        Returns the number of layers written.
+        '''
+        start = time.time()
+        no = None
+        try:
+            transform = self.set_parameter(para)
+            buckets = FacetBuckets(self.height * band_layers, self.height)
+            try:
+                stats = MeshStats()
+                self.loaded = False
+                try:
+                    f = open(filename, 'rb')
+                    try:
+                        for normals, vertices in self.read_blocks(f):
+                            out_vertices = numpy.empty(vertices.shape)
+                            out_normals = numpy.empty(normals.shape)
+                            transform.apply(vertices, normals, out_vertices, out_normals)
+                            stats.add(out_vertices)
+                            buckets.add(out_vertices)
+                    finally:
+                        f.close()
+                except (IOError, FormatError), e:
+                    print e
+                    self.loaded = False
+                
+                if not self.loaded or stats.count == 0:
+                    self.loaded = False
+                    self.queue.put(0)
+                    return 0
+                
+                # The model itself stays unloaded, only its dimension is kept
+                self.loaded = False
+                self.transform_key = None
+                self.stats_key = None
+                self.set_stats(stats)
+                no = int((self.maxz - self.minz) / self.height)
+                self.queue.put(no)
+                
+                writer = slice_writer(outname, self)
+                try:
+                    z = self.minz + self.height
+                    lastz = self.minz
+                    band = int(math.floor(z / buckets.size))
+                    ok = True
+                    while ok and z <= self.maxz:
+                        top = min((band + 1) * buckets.size, self.maxz)
+                        for code, z, layer in self.sweep_layers(z, lastz, top, buckets.load(band)):
+                            if code == ERROR:
+                                ok = False
+                                break
+                            elif code == LAYER:
+                                layer.id = writer.count + 1
+                                writer.write(layer)
+                                self.queue.put(layer.id)
+                                print 'layer', layer.id, '/', no
+                            lastz = z
+                            z += self.height
+                        band += 1
+                finally:
+                    writer.close()
+            finally:
+                buckets.close()
+        except:
+            # Whoever follows the progress must not wait for ever
+            if no is None:
+                self.queue.put(0)
+            else:
+                self.queue.put("done")
+            raise
+        
+        self.queue.put("done")
+        print 'no of layers:', writer.count
+        cpu = '%.1f' % (time.time() - start)
+        print 'slice cpu', cpu,'secs'
+        return writer.count
+
+    def create_layers_parallel(self, no, writer=None):
+        ''' Slice bands of layers in a process pool.
+
+        The vertices, and their order by lowest z, which is sorted once 
+        here, are shared with the workers through shared memory. Every 
+        band starts on the nominal layer grid, so a REDO only shifts the 
+        layers of its own band.
+        '''
+        vertices = multiprocessing.RawArray('d', self.vertices.size)
+        shared = numpy.frombuffer(vertices).reshape(self.vertices.shape)
+        shared[:] = self.vertices
+        order = multiprocessing.RawArray('l', len(self.vertices))
+        numpy.frombuffer(order, dtype=numpy.int_)[:] = SweepIndex(self.vertices).order
+        
+        size = max(1, no // (self.processes * 4))
+        bands = []
+        for first in range(1, no + 1, size):
+            last = first + size
+            if last > no:
+                top = self.maxz
+            else:
+                top = self.minz + (last - 0.5) * self.height
+            bands.append((self.minz + first * self.height, top))
+        
+        para = (vertices, self.vertices.shape, order, self.minz, self.height, self.pitch)
+        pool = multiprocessing.Pool(self.processes, init_slice_worker, para)
+        layers = []
+        count = 0
+        try:
+            for band, ok in pool.imap(slice_band, bands):
+                for layer in band:
+                    count += 1
+                    layer.id = count
+                if writer is None:
+                    layers.extend(band)
+                else:
+                    for layer in band:
+                        writer.write(layer)
+                self.queue.put(count)
+                if not ok:
+                    break
+        finally:
+            pool.terminate()
+        
+        return layers
+
+    def create_one_layer(self, z, facets=None, vertices=None):
+        ''' Intersect the facets with plane z, by default all of them.
+
+        facets index into vertices, the model facets by default.
+        '''
+        layer = Layer(z, self.pitch)
+        lines = []
+        if vertices is None:
+            vertices = self.vertices
+        if facets is None:
+            zs = vertices[:, :, 2]
+            spanned = (zs.min(axis=1) <= z) & (zs.max(axis=1) >= z)
+            facets = numpy.flatnonzero(spanned)
+
+        codes, segments = intersect_facets(vertices[facets], z)
+        if (codes == REDO).any():
+            return (REDO, None)
+        
+        segments = segments[codes == INTERSECTED].tolist()
+        for (x1, y1), (x2, y2) in segments:
+            lines.append(Line(Point(x1, y1, z), Point(x2, y2, z)))
+        
+        if len(lines) != 0:
+            ok = layer.set_lines(lines)
+            if ok:
+                return (LAYER, layer)
+            else:
+                return (ERROR, None)
+        else:
+            return (NOT_LAYER, None)
+
+def model_arrays(normals, vertices):
+    ''' Vertices and their facet normals as float32 (3n, 3) arrays'''
+    points = vertices.reshape(-1, 3).astype(numpy.float32)
+    normals = numpy.repeat(normals.astype(numpy.float32), 3, axis=0)
+    return normals, points
+
+def cluster_facets(vertices, cells=PREVIEW_CELLS):
+    ''' Coarse copy of the facets by vertex clustering.
+
+    The vertices are snapped to the center of their cell in a grid with
+    cells cells along the longest side of the model. Facets which lose 
+    a corner that way, and repeated facets, are left out. Returns the
+    normals and vertices of the remaining facets.
+    '''
+    points = vertices.reshape(-1, 3)
+    lower = points.min(axis=0)
+    side = (points.max(axis=0) - lower).max() / cells
+    if side == 0.0:
+        return numpy.zeros((0, 3)), numpy.zeros((0, 3, 3))
+
+    grid = numpy.minimum(((points - lower) / side).astype(numpy.int64), cells - 1)
+    keys = (grid[:, 0] * cells + grid[:, 1]) * cells + grid[:, 2]
+    keys, cluster = numpy.unique(keys, return_inverse=True)
+    counts = numpy.bincount(cluster)
+    centers = numpy.empty((len(keys), 3))
+    for i in range(3):
+        centers[:, i] = numpy.bincount(cluster, points[:, i]) / counts
+    
+    corners = cluster.reshape(-1, 3)
+    keep = ((corners[:, 0] != corners[:, 1]) & (corners[:, 1] != corners[:, 2]) & 
+            (corners[:, 2] != corners[:, 0]))
+    corners = corners[keep]
+    # at most cells ** 3 clusters, so the key of a facet fits in 64 bits
+    n = len(keys)
+    ordered = numpy.sort(corners, axis=1).astype(numpy.int64)
+    keys = (ordered[:, 0] * n + ordered[:, 1]) * n + ordered[:, 2]
+    keys, first = numpy.unique(keys, return_index=True)
+    corners = corners[numpy.sort(first)]
+
+    facets = centers[corners]
+    normals = numpy.cross(facets[:, 1] - facets[:, 0], facets[:, 2] - facets[:, 0])
+    lengths = numpy.sqrt((normals ** 2).sum(axis=1))
+    lengths[lengths == 0.0] = 1.0
+    return normals / lengths[:, numpy.newaxis], facets
+
+slice_worker = None
+
+slice_order = None
+
+def init_slice_worker(vertices, shape, order, minz, height, pitch):
+    ''' Set up the model of a slicing process over the shared vertices
+    and their shared order by lowest z'''
+    global slice_worker, slice_order
+    vertices = numpy.frombuffer(vertices).reshape(shape)
+    slice_order = numpy.frombuffer(order, dtype=numpy.int_)
+    slice_worker = CadModel()
+    slice_worker.vertices = vertices
+    slice_worker.minz = minz
+    slice_worker.height = height
+    slice_worker.pitch = pitch
+
+def slice_band(band):
+    z, top = band
+    return slice_worker.create_band(z, z - slice_worker.height, top, order=slice_order)
+
+def main(argv=None):
+    ''' Slice STL files into slice files from the command line'''
+    parser = optparse.OptionParser(usage="%prog [options] model.stl ...",
+        description="Slice STL CAD files layer by layer into slice files "
+                    "named after the models, or OUTPUT for a single model.")
+    parser.add_option("-H", "--height", default="0.5", help="layer height [%default]")
+    parser.add_option("-p", "--pitch", default="0.5", help="scan line pitch [%default]")
+    parser.add_option("-d", "--direction", default="+Z", type="choice", 
+        choices=sorted(DIRECTIONS), help="slicing direction [%default]")
+    parser.add_option("-s", "--scale", default="1", help="scale factor [%default]")
+    parser.add_option("--speed", default="10", help="scan speed [%default]")
+    parser.add_option("--fast", default="20", help="fast move speed [%default]")
+    parser.add_option("-e", "--ext", default=SLICE_EXT, 
+        help="slice file extension, %s, .xml or .xml.gz [%%default]" % SLICE_EXT)
+    parser.add_option("-o", "--output", help="slice file of a single model")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("no STL file")
+    if options.output and len(args) > 1:
+        parser.error("--output takes a single STL file")
+
+    para = {"height":options.height, "pitch":options.pitch, "speed":options.speed,
+            "fast":options.fast, "direction":options.direction, "scale":options.scale}
+    failed = 0
+    for filename in args:
+        outname = options.output
+        if not outname:
+            outname = os.path.splitext(filename)[0] + options.ext
+        cadmodel = CadModel()
+        cadmodel.logger.setLevel(logging.WARNING)
+        cadmodel.queue = Queue.Queue()
+        if cadmodel.slice_file(filename, para, outname) == 0:
+            print >> sys.stderr, 'no layers in', filename
+            failed += 1
+        else:
+            print filename, '->', outname
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import sys
+import os
+sys.path.append(os.path.join(sys.path[0], ".."))
+from slicer import *
+import logging
+import timeit
+import Queue
+import subprocess
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+GEAR = os.path.join(DATA, "gear.stl")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SLICE_PARAMETER = {"height":"0.5", "pitch":"0.3", "speed":"10", "fast":"20", "direction":"-X", "scale":"2"}
+
+class StringHashPoint:
+    ''' Point as it was before the grid key, for comparison'''
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __eq__(self, other):
+        return equal(self.x, other.x) and equal(self.y, other.y) and equal(self.z, other.z)
+
+    def __hash__(self):
+        s = '%.6f %.6f %.6f' % (self.x, self.y, self.z)
+        return hash(s)
+
+def best(func, number=1, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat))
+
+def slice_model(filename, para=SLICE_PARAMETER):
+    cadmodel = CadModel()
+    cadmodel.logger.setLevel(logging.ERROR)
+    cadmodel.open(filename)
+    cadmodel.queue = Queue.Queue()
+    cadmodel.slice(para)
+    return cadmodel
+
+def layer_points(cadmodel):
+    points = []
+    for layer in cadmodel.layers:
+        for loop in layer.loops:
+            for line in loop:
+                points.append(line.p1)
+                points.append(line.p2)
+    return points
+
+def bench_point():
+    ''' Hash and compare the loop points of gear.stl'''
+    points = layer_points(slice_model(GEAR))
+    old = [StringHashPoint(p.x, p.y, p.z) for p in points]
+    pairs = zip(points, points[1:] + points[:1])
+    old_pairs = zip(old, old[1:] + old[:1])
+
+    def hash_new():
+        for p in points:
+            hash(p)
+
+    def hash_old():
+        for p in old:
+            hash(p)
+
+    def eq_new():
+        for p1, p2 in pairs:
+            p1 == p2
+
+    def eq_old():
+        for p1, p2 in old_pairs:
+            p1 == p2
+
+    print 'points', len(points)
+    for name, func_new, func_old in (('hash', hash_new, hash_old), ('eq', eq_new, eq_old)):
+        t1 = best(func_old, number=10)
+        t2 = best(func_new, number=10)
+        print '%-6s string %.3f secs, key %.3f secs, %.1fx' % (name, t1, t2, t1 / t2)
+
+def bench_slice():
+    ''' Open and slice gear.stl'''
+    t = best(lambda: slice_model(GEAR), repeat=3)
+    print 'slice gear.stl %.2f secs' % t
+
+def bench_startup():
+    ''' Start a new interpreter and import the core, the GUI and numpy alone'''
+    def python(code):
+        return lambda: subprocess.call([sys.executable, "-c", code], cwd=ROOT)
+
+    for name, code in (('python', 'pass'), ('numpy', 'import numpy'),
+                       ('slicer', 'import slicer'), ('blackcat', 'import blackcat')):
+        print 'start %-8s %.3f secs' % (name, best(python(code), repeat=5))
+
+    out = os.path.join(DATA, "gear.bcs")
+    command = [sys.executable, os.path.join(ROOT, "slicer.py"), "-o", out, GEAR]
+    devnull = open(os.devnull, 'w')
+    t = best(lambda: subprocess.call(command, stdout=devnull), repeat=3)
+    devnull.close()
+    os.remove(out)
+    print 'slicer.py gear.stl %.2f secs' % t
+
+FIRST_FRAME = '''
+import time
+start = time.time()
+import wx
+import blackcat
+app = blackcat.BlackcatApp()
+
+def OnIdle(event):
+    app.frame.Unbind(wx.EVT_IDLE)
+    print time.time() - start
+    app.frame.Close()
+
+app.frame.Bind(wx.EVT_IDLE, OnIdle)
+app.MainLoop()
+'''
+
+def bench_first_frame():
+    ''' Start the GUI and time from the first import until the frame is idle'''
+    def first_frame():
+        p = subprocess.Popen([sys.executable, "-c", FIRST_FRAME], cwd=ROOT, 
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise RuntimeError(err.strip().splitlines()[-1])
+        return float(out.split()[-1])
+
+    try:
+        t = min(first_frame() for i in range(3))
+    except (RuntimeError, ValueError, IndexError), e:
+        print 'first frame skipped,', e
+        return
+    print 'first frame %.3f secs' % t
+
+if __name__ == '__main__':
+    bench_point()
+    bench_slice()
+    bench_startup()
+    bench_first_frame()
@@ -1,8 +1,111 @@
 import sys
 import os
 sys.path.append(os.path.join(sys.path[0], ".."))
-from blackcat import *
+from slicer import *
 import unittest
+import struct
+import numpy
+import Queue
+import thread
+import StringIO
+import gzip
+import tempfile
+import shutil
+
+# The GUI and its GL buffers are only tested where wx is installed
+try:
+    import wx
+    from blackcat import LayerBufferCache, model_buffer
+except ImportError:
+    wx = None
+
+def write_binary_stl(cadmodel, fname):
+    records = numpy.zeros(len(cadmodel.vertices), dtype=STL_RECORD)
+    records['normal'] = cadmodel.normals
+    records['vertices'] = cadmodel.vertices
+    f = open(fname, 'wb')
+    f.write('solid binary'.ljust(80))
+    f.write(struct.pack('<I', len(records)))
+    f.write(records.tostring())
+    f.close()
+
+def print_layer(layer, f):
+    ''' Layer.write as it was before the layers were formatted in one go'''
+    print >> f, '<layer id="', layer.id, '">'
+    for tag, paths in (('loop', layer.loops), ('chunk', layer.chunks)):
+        print >> f, '<%ss num="' % tag, len(paths), '">'
+        count = 1
+        for path in paths:
+            print >> f, '<%s id="' % tag, count, '">'
+            for line in path:
+                print >> f, '<line>'
+                for p in (line.p1, line.p2):
+                    print >> f, '<point>',
+                    print >> f, '<x>', p.x, '</x>',
+                    print >> f, '<y>', p.y, '</y>',
+                    print >> f, '<z>', p.z, '</z>',
+                    print >> f, '</point>'
+                print >> f, '</line>'
+            print >> f, '</%s>' % tag
+            count += 1
+        print >> f, '</%ss>' % tag
+    print >> f, '</layer>'
+
+def scan_layer(layer, y):
+    ''' Layer.create_one_scanline as it was before the active edge table,
+    returns the x of the crossings of y with the loops, or None where it
+    asked for the scanline to be moved for a horizontal edge on y'''
+    s = set()
+    for loop in layer.loops:
+        for line in loop:
+            y1 = line.p1.y
+            y2 = line.p2.y
+            if (y1 - y) * (y2 - y) > 0.0:
+                continue
+            points = [p for p in (line.p1, line.p2) if equal(y, p.y)]
+            if len(points) == 2:
+                return None
+            elif len(points) == 1:
+                p = points[0]
+                L = []
+                for it in loop:
+                    if p == it.p1:
+                        L.append(it.p2)
+                    elif p == it.p2:
+                        L.append(it.p1)
+                if (L[0].y - y) * (L[1].y - y) <= 0.0:
+                    s.add('%.6f' % p.x)
+            elif equal(line.p1.x, line.p2.x):
+                s.add('%.6f' % line.p1.x)
+            else:
+                x = (y - y1) * (line.p2.x - line.p1.x) / (y2 - y1) + line.p1.x
+                s.add('%.6f' % x)
+    xlist = sorted(map(float, s))
+    assert len(xlist) % 2 == 0
+    return xlist
+
+def chain_scanlines(layer, scanlines):
+    ''' Layer.create_chunks as it was before the two-pointer merge'''
+    chunks = []
+    scanlines = [list(scanline) for scanline in scanlines]
+    while len(scanlines) != 0:
+        line = scanlines[0].pop(0)
+        chunk = [line]
+        for scanline in scanlines[1:]:
+            distance = abs(scanline[0].p1.y - line.p1.y)
+            if not (equal(distance, layer.pitch) or distance < layer.pitch):
+                break
+            for aline in scanline:
+                if not (aline.p1.x >= line.p2.x or aline.p2.x <= line.p1.x):
+                    break
+            else:
+                break
+            chunk.append(aline)
+            scanline.remove(aline)
+            line = aline
+        chunks.append(chunk)
+        scanlines = [scanline for scanline in scanlines if len(scanline) > 0]
+    return chunks
 
 class CadModelTest(unittest.TestCase):
     def setUp(self):
@@ -16,6 +119,519 @@ class CadModelTest(unittest.TestCase):
         ok = cadmodel.open("rect.stl")
         self.assert_(ok)
 
+    def testFacetStore(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("rect.stl")
+        self.assert_(ok)
+        self.assert_(cadmodel.vertices.shape == (12, 3, 3))
+        self.assert_(cadmodel.normals.shape == (12, 3))
+        self.assert_(len(cadmodel.facets) == 12)
+
+        facet = cadmodel.facets[0]
+        p = facet.points[0]
+        self.assert_(p.x == cadmodel.vertices[0, 0, 0])
+        self.assert_(p.z == cadmodel.vertices[0, 0, 2])
+        self.assert_(facet.normal.z == cadmodel.normals[0, 2])
+
+    def testCalcDimension(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("rect.stl")
+        self.assert_(ok)
+        self.assert_(cadmodel.facet_count == 12)
+        self.assert_((cadmodel.xsize, cadmodel.ysize, cadmodel.zsize) == (8.0, 4.0, 4.0))
+        self.assert_((cadmodel.xcenter, cadmodel.ycenter, cadmodel.zcenter) == (4.0, -2.0, 2.0))
+        self.assert_(abs(cadmodel.area - 160.0) < LIMIT)
+        self.assert_(abs(cadmodel.volume - 128.0) < LIMIT)
+
+        cadmodel.transform_model(Transform().scale(2.0))
+        cadmodel.calc_dimension()
+        self.assert_(cadmodel.xsize == 16.0)
+        self.assert_(abs(cadmodel.volume - 1024.0) < LIMIT)
+
+    def testOpen_again(self):
+        # the frame opens every model into the same CadModel
+        cadmodel = CadModel()
+        for name in ("rect.stl", "rect.stl", "gear.stl", "hole.stl"):
+            ok = cadmodel.open(name)
+            self.assert_(ok)
+            self.assert_(cadmodel.loaded)
+        hole = CadModel()
+        hole.open("hole.stl")
+        self.assert_((cadmodel.vertices == hole.vertices).all())
+
+    def testOpen_binary(self):
+        ascii = CadModel()
+        ok = ascii.open("rect.stl")
+        self.assert_(ok)
+
+        n = len(ascii.facets)
+        fname = 'tmp.stl'
+        write_binary_stl(ascii, fname)
+
+        cadmodel = CadModel()
+        ok = cadmodel.open(fname)
+        self.assert_(ok)
+        self.assert_(len(cadmodel.facets) == n)
+        self.assert_(numpy.allclose(cadmodel.vertices, ascii.vertices))
+        self.assert_(numpy.allclose(cadmodel.normals, ascii.normals))
+        self.assert_(cadmodel.zsize == ascii.zsize)
+        os.remove(fname)
+
+    def testSliceFile_error(self):
+        # the progress always ends, even when slicing fails
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        stream = CadModel()
+        stream.queue = Queue.Queue()
+        self.assertRaises((IOError, OSError), stream.slice_file, "hole.stl", para, 'nodir/tmp.xml')
+        self.assert_(stream.queue.get() > 0)
+        self.assert_(stream.queue.get() == "done")
+
+        class Failing(CadModel):
+            def sweep_layers(self, *args):
+                raise ValueError("failed")
+        stream = Failing()
+        stream.queue = Queue.Queue()
+        self.assertRaises(ValueError, stream.slice_file, "hole.stl", para, 'tmp.xml')
+        self.assert_(stream.queue.get() > 0)
+        self.assert_(stream.queue.get() == "done")
+        self.assert_(open('tmp.xml').read().endswith('</slice>\n'))
+        os.remove('tmp.xml')
+
+    def testSliceFile(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"-X", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        cadmodel.save('tmp1.xml')
+
+        stream = CadModel()
+        stream.queue = Queue.Queue()
+        no = stream.slice_file("hole.stl", para, 'tmp2.xml', 2)
+        self.assert_(no == len(cadmodel.layers))
+        self.assert_(not stream.loaded)
+        self.assert_(stream.zsize == cadmodel.zsize)
+
+        lines1 = open('tmp1.xml').readlines()
+        lines2 = open('tmp2.xml').readlines()
+        self.assert_(lines2[11] == '<layers num=" %d ">\n' % no)
+        self.assert_(lines1 == lines2)
+        os.remove('tmp1.xml')
+        os.remove('tmp2.xml')
+
+    def testMain(self):
+        import slicer
+        para = {"height":"0.5", "pitch":"0.3", "speed":"10", "fast":"20", "direction":"-Y", "scale":"2"}
+        cadmodel = CadModel()
+        cadmodel.queue = Queue.Queue()
+        no = cadmodel.slice_file("hole.stl", para, 'tmp1.bcs')
+        code = slicer.main(["-H", "0.5", "-p", "0.3", "-d", "-Y", "-s", "2", "-o", "tmp2.bcs", "hole.stl"])
+        self.assert_(code == 0)
+        self.assert_(open('tmp1.bcs', 'rb').read() == open('tmp2.bcs', 'rb').read())
+        self.assert_(slicer.main(["-e", ".xml", "hole.stl", "rect.stl"]) == 0)
+        self.assert_(os.path.exists("hole.xml") and os.path.exists("rect.xml"))
+        # every model logs through the one handler
+        self.assert_(len(cadmodel.logger.handlers) == 1)
+        for name in ('tmp1.bcs', 'tmp2.bcs', 'hole.xml', 'rect.xml'):
+            os.remove(name)
+
+        # the core does not pull in the GUI
+        command = '%s -c "import sys; sys.path.insert(0, %r); import slicer; print sorted(sys.modules)"'
+        path = os.path.dirname(os.path.abspath(slicer.__file__))
+        modules = os.popen(command % (sys.executable, path)).read()
+        self.assert_("slicer" in modules and "wx" not in modules and "OpenGL" not in modules)
+
+    def testExport(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("island.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        cadmodel.save('tmp1.xml')
+        count = len(cadmodel.layers)
+
+        no = cadmodel.export(para, 'tmp2.xml')
+        self.assert_(no == count)
+        self.assert_(not cadmodel.sliced)
+        self.assert_(len(cadmodel.layers) == 0)
+
+        lines1 = open('tmp1.xml').readlines()
+        lines2 = open('tmp2.xml').readlines()
+        self.assert_(lines2[11] == '<layers num=" %d ">\n' % no)
+        self.assert_(lines1 == lines2)
+        os.remove('tmp1.xml')
+        os.remove('tmp2.xml')
+
+    def testSlice_binary(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        for name in ("gear.stl", "hole.stl", "island.stl"):
+            ascii = CadModel()
+            ok = ascii.open(name)
+            self.assert_(ok)
+            write_binary_stl(ascii, 'tmp.stl')
+
+            # float32 facets are sliced on a float64 copy
+            cadmodel = CadModel()
+            ok = cadmodel.open('tmp.stl')
+            self.assert_(ok)
+            version = cadmodel.facets_version
+            cadmodel.queue = Queue.Queue()
+            ok = cadmodel.slice(para)
+            self.assert_(ok)
+            self.assert_(cadmodel.vertices.dtype == numpy.float64)
+            self.assert_(len(cadmodel.layers) > 0)
+            self.assert_(cadmodel.facets_version == version)
+        os.remove('tmp.stl')
+
+    def testSliceFile_binary(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"-X", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        fname = 'tmp' + SLICE_EXT
+        cadmodel.save(fname)
+
+        slices = SliceFile(fname)
+        self.assert_(len(slices) == len(cadmodel.layers))
+        self.assert_(slices.zsize == cadmodel.zsize)
+        self.assert_(slices.pitch == 0.5)
+        for i in (0, len(slices) // 2, len(slices) - 1):
+            layer = cadmodel.layers[i]
+            loaded = slices.layer(i)
+            self.assert_(loaded.id == layer.id)
+            self.assert_(loaded.z == layer.z)
+            self.assert_(len(loaded.loops) == len(layer.loops))
+            self.assert_(len(loaded.chunks) == len(layer.chunks))
+            for path, other in zip(layer.loops + layer.chunks, loaded.loops + loaded.chunks):
+                self.assert_(len(path) == len(other))
+                for line, line2 in zip(path, other):
+                    self.assert_(abs(line.p1.x - line2.p1.x) < 1e-4)
+                    self.assert_(abs(line.p2.y - line2.p2.y) < 1e-4)
+        del slices
+        os.remove(fname)
+
+    def testLayerFormat(self):
+        para = {"height":"0.5", "pitch":"0.3", "speed":"10", "fast":"20", "direction":"-X", "scale":"1"}
+        for name in ("hole.stl", "island.stl", "rect.stl"):
+            cadmodel = CadModel()
+            ok = cadmodel.open(name)
+            self.assert_(ok)
+            cadmodel.queue = Queue.Queue()
+            ok = cadmodel.slice(para)
+            self.assert_(ok)
+            for layer in cadmodel.layers:
+                f = StringIO.StringIO()
+                print_layer(layer, f)
+                self.assert_(layer.format() == f.getvalue())
+
+        # Points off the layer plane and -0.0 are kept as they are
+        layer = Layer(1.0, 0.5)
+        layer.id = 1
+        layer.loops = [[Line(Point(-0.0, 0.5, 1.0), Point(0.0, 2.0, 1.0)),
+                        Line(Point(0.0, 2.0, 1.0), Point(-0.0, 0.5, 1.5))]]
+        layer.chunks = []
+        f = StringIO.StringIO()
+        print_layer(layer, f)
+        self.assert_(layer.format() == f.getvalue())
+
+    def testLineArrays(self):
+        layer = Layer(1.0, 0.5)
+        layer.loops = [[Line(Point(0, 0, 1), Point(1, 0, 1)), Line(Point(1, 0, 1), Point(0, 0, 1))]]
+        layer.chunks = [[Line(Point(0, 1, 1), Point(1, 1, 1))]] * 9
+        vertices, colors = layer.line_arrays()
+        self.assert_(vertices.shape == (22, 3) and colors.shape == (22, 3))
+        self.assert_(vertices.dtype == numpy.float32)
+        self.assert_(list(vertices[0]) == [0, 1, 1])
+        self.assert_(list(vertices[-1]) == [0, 0, 1])
+        # the same chunk gets the same color every time
+        self.assert_(list(colors[0]) == list(colors[1]) == Layer.colors[0])
+        self.assert_(list(colors[16]) == Layer.colors[8 % len(Layer.colors)])
+        self.assert_(list(colors[18]) == [1, 1, 1])
+        self.assert_((layer.line_arrays()[1] == colors).all())
+
+    def testModelArrays(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        normals, points = model_arrays(cadmodel.normals, cadmodel.vertices)
+        n = len(cadmodel.vertices)
+        self.assert_(points.shape == (3 * n, 3) and normals.shape == (3 * n, 3))
+        self.assert_(points.dtype == numpy.float32)
+        self.assert_((points[3:6] == cadmodel.vertices[1].astype(numpy.float32)).all())
+        self.assert_((normals[3:6] == cadmodel.normals[1].astype(numpy.float32)).all())
+
+    def testClusterFacets(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("gear.stl")
+        self.assert_(ok)
+        vertices = cadmodel.vertices
+        normals, facets = cluster_facets(vertices, 10)
+        self.assert_(0 < len(facets) < len(vertices) and normals.shape == (len(facets), 3))
+        self.assert_((facets.min(axis=0) >= vertices.min(axis=0) - 1e-9).all())
+        self.assert_((facets.max(axis=0) <= vertices.max(axis=0) + 1e-9).all())
+        self.assert_(numpy.allclose((normals ** 2).sum(axis=1), 1.0))
+        # no facet has two corners in one cell or shows up twice
+        corners = [tuple(sorted(map(tuple, f))) for f in facets.tolist()]
+        self.assert_(all(len(set(c)) == 3 for c in corners))
+        self.assert_(len(set(corners)) == len(corners))
+
+        normals, facets = cluster_facets(vertices, 1000)
+        self.assert_(len(facets) > len(cluster_facets(vertices, 10)[1]))
+
+    def testSave_gzip(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        cadmodel.save('tmp.xml')
+        cadmodel.save('tmp.xml.gz')
+        text = open('tmp.xml').read()
+        self.assert_(gzip.open('tmp.xml.gz').read() == text)
+
+        no = cadmodel.export(para, 'tmp.xml.gz')
+        self.assert_(no > 0)
+        lines = gzip.open('tmp.xml.gz').readlines()
+        self.assert_(lines[11].split() == ['<layers', 'num="', str(no), '">'])
+        os.remove('tmp.xml')
+        os.remove('tmp.xml.gz')
+
+    def testOpenSlices(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"-X", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("island.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        layers = cadmodel.layers
+
+        for fname in ('tmp' + SLICE_EXT, 'tmp.xml', 'tmp.xml.gz'):
+            cadmodel.save(fname)
+            viewer = CadModel()
+            ok = viewer.open_slices(fname)
+            self.assert_(ok)
+            self.assert_(viewer.sliced and not viewer.loaded)
+            self.assert_(len(viewer.layers) == len(layers))
+            self.assert_(viewer.pitch == 0.5 and viewer.speed == 10.0)
+            self.assert_(abs(viewer.zsize - cadmodel.zsize) < 1e-6)
+            self.assert_(abs(viewer.zcenter - cadmodel.zcenter) < viewer.height)
+
+            viewer.prev_layer()
+            layer = viewer.get_curr_layer()
+            self.assert_(layer.id == len(layers))
+            self.assert_(viewer.layers[-1] is layer)
+            original = layers[-1]
+            self.assert_(abs(layer.z - original.z) < 1e-6)
+            self.assert_(len(layer.loops) == len(original.loops))
+            self.assert_(len(layer.chunks) == len(original.chunks))
+            for path, other in zip(original.loops + original.chunks, layer.loops + layer.chunks):
+                self.assert_(len(path) == len(other))
+                self.assert_(abs(path[0].p1.x - other[0].p1.x) < 1e-4)
+            os.remove(fname)
+
+        self.assert_(not viewer.open_slices("rect.stl"))
+
+    def testCloseSlices(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        cadmodel.save('tmp.xml.gz')
+
+        def open_files():
+            if os.path.isdir('/proc/self/fd'):
+                return len(os.listdir('/proc/self/fd'))
+        files = open_files()
+        temps = os.listdir(tempfile.gettempdir())
+
+        # the unpacked copy goes when the slice file is closed
+        slices = XmlSliceFile('tmp.xml.gz')
+        self.assert_(len(slices) == len(cadmodel.layers))
+        slices.close()
+        self.assert_(slices.f.closed)
+        self.assert_(open_files() == files)
+
+        # opening a model or other slices closes the slices viewed
+        viewer = CadModel()
+        ok = viewer.open_slices('tmp.xml.gz')
+        self.assert_(ok)
+        slices = viewer.layers.slices
+        viewer.get_curr_layer()
+        ok = viewer.open_slices('tmp.xml.gz')
+        self.assert_(ok)
+        self.assert_(slices.f.closed)
+        slices = viewer.layers.slices
+        ok = viewer.open("hole.stl")
+        self.assert_(ok)
+        self.assert_(slices.f.closed and viewer.layers == [])
+        self.assert_(open_files() == files)
+        self.assert_(os.listdir(tempfile.gettempdir()) == temps)
+        os.remove('tmp.xml.gz')
+
+    def testSlice_progress(self):
+        # the frame slices in a thread and looks at the model after "done"
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1"}
+        directory = tempfile.mkdtemp()
+        cadmodel = CadModel()
+        cadmodel.cache = SliceCache(directory)
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        for hit in (False, True):
+            cadmodel.queue = Queue.Queue()
+            thread.start_new_thread(cadmodel.slice, (para,))
+            no = cadmodel.queue.get()
+            self.assert_(no > 0)
+            while cadmodel.queue.get() != "done":
+                pass
+            self.assert_(cadmodel.sliced and cadmodel.curr_layer == 0)
+            self.assert_(isinstance(cadmodel.layers, SliceLayers) == hit)
+            self.assert_(len(os.listdir(directory)) == 1)
+            self.assert_(not [name for name in os.listdir(directory) if name.endswith('.tmp')])
+        shutil.rmtree(directory)
+
+    def testSlice_parallel(self):
+        for name, direction in (("gear.stl", "+Z"), ("hole.stl", "-X")):
+            models = []
+            for processes in ("1", "2"):
+                para = {"height":"0.5", "pitch":"0.3", "speed":"10", "fast":"20", 
+                        "direction":direction, "scale":"1", "processes":processes}
+                cadmodel = CadModel()
+                ok = cadmodel.open(name)
+                self.assert_(ok)
+                cadmodel.queue = Queue.Queue()
+                ok = cadmodel.slice(para)
+                self.assert_(ok)
+                models.append(cadmodel)
+
+            # a REDO shifts the rest of the layers serially, only its band 
+            # in parallel, so z may differ by the REDO step
+            serial, parallel = models
+            self.assert_(len(serial.layers) == len(parallel.layers))
+            for i, (layer1, layer2) in enumerate(zip(serial.layers, parallel.layers)):
+                self.assert_(layer2.id == i + 1)
+                self.assert_(abs(layer1.z - layer2.z) <= 0.02 * serial.height)
+                self.assert_(len(layer1.loops) == len(layer2.loops))
+                self.assert_(len(layer1.chunks) == len(layer2.chunks))
+
+    def testSliceCache(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1"}
+        directory = tempfile.mkdtemp()
+        cache = SliceCache(directory)
+        cadmodel = CadModel()
+        cadmodel.cache = cache
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        self.assert_(isinstance(cadmodel.layers, list))
+        self.assert_(len(os.listdir(directory)) == 1)
+        cadmodel.save('tmp1.xml')
+
+        cached = CadModel()
+        cached.cache = cache
+        ok = cached.open("hole.stl")
+        self.assert_(ok)
+        cached.queue = Queue.Queue()
+        ok = cached.slice(para)
+        self.assert_(ok)
+        self.assert_(isinstance(cached.layers, SliceLayers))
+        self.assert_(cached.queue.get() == len(cached.layers))
+        self.assert_(cached.queue.get() == "done")
+        cached.save('tmp2.xml')
+        self.assert_(open('tmp1.xml').read() == open('tmp2.xml').read())
+
+        # speed does not change the layers, the pitch does
+        para["speed"] = "20"
+        ok = cached.slice(para)
+        self.assert_(isinstance(cached.layers, SliceLayers))
+        para["pitch"] = "0.3"
+        ok = cached.slice(para)
+        self.assert_(isinstance(cached.layers, list))
+        self.assert_(len(os.listdir(directory)) == 2)
+
+        # Only the most recently used entry fits
+        cache.max_size = os.path.getsize(cache.get(cached.cache_key))
+        cached.slice({"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1"})
+        cache.evict()
+        self.assert_(os.listdir(directory) == [cached.cache_key + SLICE_EXT])
+
+        os.remove('tmp1.xml')
+        os.remove('tmp2.xml')
+        shutil.rmtree(directory)
+
+    def testSweepIndex(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+
+        sweep = SweepIndex(cadmodel.vertices)
+        # sweeping in a given order, as the slicing processes do
+        presorted = SweepIndex(cadmodel.vertices, sweep.order.copy())
+        zs = cadmodel.vertices[:, :, 2]
+        lastz = cadmodel.minz
+        for z in numpy.linspace(cadmodel.minz, cadmodel.maxz, 17):
+            L1 = sweep.facets_at(z, lastz)
+            L2 = numpy.flatnonzero((zs.min(axis=1) <= z) & (zs.max(axis=1) >= z))
+            self.assert_(list(L1) == list(L2))
+            self.assert_(list(presorted.facets_at(z, lastz)) == list(L2))
+            lastz = z
+
+    def testIntersectFacets(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+
+        n = len(cadmodel.facets)
+        for z in numpy.linspace(cadmodel.minz, cadmodel.maxz, 13):
+            codes, segments = intersect_facets(cadmodel.vertices, z)
+            codes2, segments2 = intersect_facets(cadmodel.vertices, [z] * n)
+            self.assert_((codes == codes2).all())
+            for i in range(n):
+                code, line = cadmodel.facets[i].intersect(z)
+                self.assert_(code == codes[i])
+                if code == INTERSECTED:
+                    (x1, y1), (x2, y2) = segments[i]
+                    self.assert_(Point(x1, y1, z) == Point(line.p1.x, line.p1.y, z))
+                    self.assert_(Point(x2, y2, z) == Point(line.p2.x, line.p2.y, z))
+                    self.assert_((segments2[i] == segments[i]).all())
+
+    def testTransform(self):
+        vertices = numpy.array([[[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 3.0]]])
+        normals = numpy.array([[0.0, 0.0, 1.0]])
+        out_vertices = numpy.empty(vertices.shape)
+        out_normals = numpy.empty(normals.shape)
+
+        transform = Transform().rotate('z', 90).translate(1.0, 0.0, 0.0)
+        transform.apply(vertices, normals, out_vertices, out_normals)
+        self.assert_(numpy.allclose(out_vertices[0, 0], [1.0, 1.0, 0.0]))
+        self.assert_(numpy.allclose(out_vertices[0, 1], [-1.0, 0.0, 0.0]))
+        self.assert_(numpy.allclose(out_normals[0], [0.0, 0.0, 1.0]))
+
+        transform = Transform().scale(2.0).orient('-X')
+        self.assert_(transform.axes() is not None)
+        transform.apply(vertices, normals, out_vertices, out_normals)
+        self.assert_((out_vertices[0, 0] == [0.0, 0.0, -2.0]).all())
+        self.assert_((out_normals[0] == [1.0, 0.0, 0.0]).all())
+
+        transform = Transform().rotate('x', 45).scale(2.0).orient('-X')
+        self.assert_(transform.axes() is None)
+        transform.apply(vertices, normals, out_vertices, out_normals)
+        self.assert_(numpy.allclose((out_normals * out_normals).sum(), 1.0))
+
     def testOpen_notexistfile(self):
         cadmodel = CadModel()
         ok = cadmodel.open("xxx.stl")
@@ -30,6 +646,7 @@ class CadModelTest(unittest.TestCase):
         cadmodel = CadModel()
         ok = cadmodel.open(fname)
         self.assert_(not ok)
+        self.assert_(not cadmodel.loaded)
 
     def testOpen_emptyfile(self):
         fname = 'tmp.txt'
@@ -39,6 +656,7 @@ class CadModelTest(unittest.TestCase):
         cadmodel = CadModel()
         ok = cadmodel.open(fname)
         self.assert_(not ok)
+        self.assert_(not cadmodel.loaded)
 
     def testOpen_normal(self):
         fname = 'tmp.txt'
@@ -50,7 +668,142 @@ class CadModelTest(unittest.TestCase):
         cadmodel = CadModel()
         ok = cadmodel.open(fname)
         self.assert_(not ok)
+        self.assert_(not cadmodel.loaded)
+    
+    def testOpen_vertex(self):
+        fname = 'tmp.txt'
+        f = open(fname, 'w')
+        print >> f, "solid TEST"
+        print >> f, "facet normal 0 0 1"
+        print >> f, "outer loop"
+        print >> f, "vertex 0 0 0"
+        print >> f, "vertex 1 0 x"
+        print >> f, "vertex 0 1 0"
+        print >> f, "endloop"
+        print >> f, "endfacet"
+        print >> f, "endsolid TEST"
+        f.close()
+
+        cadmodel = CadModel()
+        ok = cadmodel.open(fname)
+        self.assert_(not ok)
+        self.assert_(not cadmodel.loaded)
     
+    def testCreateLoops(self):
+        p1 = Point(0.0, 0.0, 1.0)
+        p2 = Point(2.0, 0.0, 1.0)
+        p3 = Point(2.0, 2.0, 1.0)
+        p4 = Point(0.0, 2.0, 1.0)
+        layer = Layer(1.0, 0.5)
+        layer.lines = [Line(p1, p2), Line(p4, p3), Line(p3, p2), Line(p4, p1)]
+        ok = layer.createLoops()
+        self.assert_(ok)
+        self.assert_(len(layer.loops) == 1)
+        self.assert_(len(layer.loops[0]) == 4)
+
+        layer.lines = [Line(p1, p2), Line(p2, p3), Line(p3, p4)]
+        ok = layer.createLoops()
+        self.assert_(not ok)
+
+    def testScanline_horizontal(self):
+        L = [(0, 0), (4, 0), (4, 1), (2, 1), (2, 3), (0, 3)]
+        points = [Point(x, y, 1.0) for x, y in L]
+        layer = Layer(1.0, 1.0)
+        layer.lines = [Line(points[i - 1], points[i]) for i in range(len(points))]
+        ok = layer.createLoops()
+        self.assert_(ok)
+        layer.calc_dimension()
+        layer.create_scanlines()
+        
+        # The scanline y = 1 runs along the edge from (4, 1) to (2, 1)
+        self.assert_(len(layer.scanlines) == 2)
+        for scanline in layer.scanlines:
+            self.assert_(len(scanline) == 1)
+            line = scanline[0]
+            self.assert_(line.p1 == Point(0, line.p1.y, 1.0))
+            self.assert_(line.p2 == Point(2, line.p1.y, 1.0))
+
+    def testScanline_flat(self):
+        # a square one pitch tall on the scanline grid next to a rectangle
+        layer = Layer(1.0, 1.0)
+        layer.lines = []
+        for L in ([(0, 0), (4, 0), (4, 10), (0, 10)], [(6, 5), (7, 5), (7, 6), (6, 6)]):
+            points = [Point(x, y, 1.0) for x, y in L]
+            layer.lines += [Line(points[i - 1], points[i]) for i in range(len(points))]
+        ok = layer.createLoops()
+        self.assert_(ok)
+        layer.calc_dimension()
+        layer.create_scanlines()
+
+        self.assert_(len(layer.scanlines) == 9)
+        square = [line for scanline in layer.scanlines for line in scanline if line.p1.x > 5]
+        self.assert_(len(square) == 1)
+        self.assert_(square[0].p1 == Point(6, 5, 1.0) and square[0].p2 == Point(7, 5, 1.0))
+
+    def testScanline_top(self):
+        # hole.stl is 15 wide, so at a pitch of 0.3 the last scanline lies 
+        # on its top edge, which is not filled
+        para = {"height":"0.5", "pitch":"0.3", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+        cadmodel.queue = Queue.Queue()
+        ok = cadmodel.slice(para)
+        self.assert_(ok)
+        for layer in cadmodel.layers:
+            self.assert_(equal(layer.maxy, 7.5))
+            ys = [line.p1.y for scanline in layer.scanlines for line in scanline]
+            self.assert_(len(layer.scanlines) == 49)
+            self.assert_(equal(min(ys), -7.2) and equal(max(ys), 7.2))
+
+    def testScanline_reference(self):
+        # The scanlines and chunks match those of the old algorithms. Where 
+        # the old scanline met a horizontal edge it was moved, the new one 
+        # takes the crossings just above the edge, less the slivers at valleys.
+        def compare(layer):
+            rows = dict((round(scanline[0].p1.y, 6), scanline) for scanline in layer.scanlines)
+            y = layer.miny + layer.pitch
+            while y < layer.maxy:
+                xlist = scan_layer(layer, y)
+                if xlist is None:
+                    xlist = scan_layer(layer, y + 1e-6)
+                L1 = [(x1, x2) for x1, x2 in zip(xlist[::2], xlist[1::2]) if x2 - x1 > 1e-4]
+                L2 = [(line.p1.x, line.p2.x) for line in rows.pop(round(y, 6), [])]
+                self.assert_(len(L1) == len(L2))
+                for (x1, x2), (x3, x4) in zip(L1, sorted(L2)):
+                    self.assert_(abs(x1 - x3) < 1e-4 and abs(x2 - x4) < 1e-4)
+                y += layer.pitch
+            self.assert_(not rows)
+            self.assert_(chain_scanlines(layer, layer.scanlines) == layer.chunks)
+
+        # vertices on the scanlines in hole, island and gear2, horizontal 
+        # edges on them in high_low and gear2
+        for name, direction in (("hole.stl", "+Z"), ("island.stl", "+Z"), 
+                                ("high_low.stl", "-X"), ("gear2.stl", "+Y")):
+            para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":direction, "scale":"1"}
+            cadmodel = CadModel()
+            ok = cadmodel.open(name)
+            self.assert_(ok)
+            cadmodel.queue = Queue.Queue()
+            ok = cadmodel.slice(para)
+            self.assert_(ok)
+            for layer in cadmodel.layers:
+                compare(layer)
+
+        # loops whose scanlines touch end to end in adjacent rows, and a 
+        # step on a scanline
+        layer = Layer(1.0, 1.0)
+        lines = []
+        for L in ([(0, 0), (2, 0), (2, 2.5), (0, 2.5)], [(2, 2.6), (4, 2.6), (4, 5), (2, 5)], 
+                  [(22, 0), (24, 0), (24, 2.5), (22, 2.5)], [(20, 2.6), (22, 2.6), (22, 5), (20, 5)], 
+                  [(5, 3), (5.5, 3), (5.5, 6), (5, 6)], [(7, 0), (11, 0), (11, 1), (9, 1), (9, 3), (7, 3)]):
+            points = [Point(x, y, 1.0) for x, y in L]
+            lines += [Line(points[i - 1], points[i]) for i in range(len(points))]
+        ok = layer.set_lines(lines)
+        self.assert_(ok)
+        self.assert_(len(layer.chunks) == 6)
+        compare(layer)
+
     def testLine(self):
         p1 = Point(1.0, 2.0, 3.0)
         p2 = Point(4.0, 5.0, 6.0)
@@ -101,5 +854,56 @@ class CadModelTest(unittest.TestCase):
         self.assert_(ok)
         ok = hash(p1) == hash(p2)
         self.assert_(ok)
+
+    def testPointKey(self):
+        p1 = Point(1.0, 2.0, 3.0)
+        p2 = Point(1.0 + LIMIT * 0.1, 2.0, 3.0 - LIMIT * 0.1)
+        p3 = Point(1.0, 2.0 + LIMIT * 10, 3.0)
+        self.assert_(p1 == p2)
+        self.assert_(p1.key == p2.key)
+        self.assert_(hash(p1) == hash(p2))
+        self.assert_(p1 != p3)
+        self.assert_(p1 < p3 and p3 > p1)
+
+        points = [p3, Point(0.0, 5.0, 0.0), p1, Point(1.0, 2.0, -1.0)]
+        points.sort()
+        for i in range(len(points) - 1):
+            self.assert_(points[i] < points[i + 1])
+
+@unittest.skipIf(wx is None, "wx is not installed")
+class GLBufferTest(unittest.TestCase):
+    def testLayerBufferCache(self):
+        layer = Layer(1.0, 0.5)
+        layer.loops = [[Line(Point(0, 0, 1), Point(1, 0, 1)), Line(Point(1, 0, 1), Point(0, 0, 1))]]
+        layer.chunks = []
+        vertices, colors = layer.line_arrays()
+
+        # least recently shown layers are dropped
+        size = vertices.nbytes + colors.nbytes
+        buffers = LayerBufferCache(2 * size)
+        b1 = buffers.get(1, lambda: layer)
+        buffers.get(2, lambda: layer)
+        self.assert_(buffers.get(1, None) is b1)
+        buffers.get(3, lambda: layer)
+        self.assert_(sorted(buffers.buffers) == [1, 3])
+        self.assert_(buffers.size == 2 * size)
+        buffers.clear()
+        self.assert_(buffers.buffers == {} and buffers.size == 0)
+
+    def testModelBuffer(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open("hole.stl")
+        self.assert_(ok)
+
+        # the facets are uploaded again only when the geometry changes
+        buffer = model_buffer(cadmodel)
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel.queue = Queue.Queue()
+        cadmodel.slice(para)
+        self.assert_(model_buffer(cadmodel, buffer) is buffer)
+        para["scale"] = "2"
+        cadmodel.slice(para)
+        self.assert_(model_buffer(cadmodel, buffer) is not buffer)
+
 if __name__ == '__main__':
     unittest.main()